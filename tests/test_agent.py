@@ -1,5 +1,11 @@
+import glob
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
 from os.path import exists, join
 
 from wildcatting.model import OilField
@@ -7,7 +13,9 @@ from wildcatting.game import (Filler, OilFiller, DrillCostFiller,
                               ReservoirFiller, PotentialOilDepthFiller)
 from wildcatting.theme import DefaultTheme
 
-from wcai.agent import Agent, Surveying, Report, Drilling, Sales
+from wcai.agent import (Agent, Surveying, Report, Drilling, Sales,
+                        ProbabilityPrediction, CHECKPOINT, LEGACY_NET)
+from wcai.data import Simulator
 
 
 # Bud Brigham is a geophysicist who believed in technology.
@@ -24,9 +32,171 @@ class AgentTest(unittest.TestCase):
         self.assertTrue(exists(join(dir, 'drilling')))
         self.assertTrue(exists(join(dir, 'sales')))
 
+    def test_learn(self):
+        agent = Agent.load(dir)
+        before = agent.weights(Agent.rl)
+        for workers, replay in [(1, 0), (2, 0), (1, 100)]:
+            agent.learn(4, epsilon=0.5, batch=2, workers=workers, sync=2,
+                        replay=replay)
+        self.assertTrue(exists(join(dir, 'sales', 'replay', 'inputs.npy')))
+        after = Agent.load(dir).weights(Agent.rl)
+        self.assertTrue(any((b != a).any() for b, a in zip(before, after)))
+
+    def test_learn_actor_failure(self):
+        agent = Agent.load(dir)
+        stores = set(glob.glob(join(tempfile.gettempdir(), 'wcai-weights-*')))
+        # actors fail to open the corpus, which is raised in the learner
+        self.assertRaises(RuntimeError, agent.learn, 4, batch=2, workers=2,
+                          corpus=join(dir, 'nope'))
+        self.assertEquals(
+            set(glob.glob(join(tempfile.gettempdir(), 'wcai-weights-*'))),
+            stores)
+
     def test_load(self):
         agent = Agent.load(dir)
 
+    def test_checkpoint(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            agent = Agent.init(tmp)
+            agent.step = 7
+            agent.save()
+            loaded = Agent.load(tmp)
+            self.assertEquals(loaded.step, 7)
+            for a, b in zip(agent.weights(Agent.rl),
+                            loaded.weights(Agent.rl)):
+                self.assertTrue((a == b).all())
+
+            loaded.learn(2, batch=2, sync=2, checkpoint=2)
+            self.assertEquals(Agent.load(tmp).step, 9)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_import(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            agent = Agent.init(tmp)
+            for comp in agent.comps.values():
+                comp.nn.save(join(comp.dir, LEGACY_NET))
+            os.remove(join(tmp, CHECKPOINT))
+
+            legacy = Agent.load(tmp)
+            Agent.import_nets(tmp)
+            self.assertTrue(exists(join(tmp, CHECKPOINT)))
+            for a, b in zip(legacy.weights(Agent.rl),
+                            Agent.load(tmp).weights(Agent.rl)):
+                self.assertTrue((a == b).all())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_train_legacy(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            agent = Agent.init(tmp)
+            for comp in agent.comps.values():
+                comp.nn.save(join(comp.dir, LEGACY_NET))
+            os.remove(join(tmp, CHECKPOINT))
+
+            # saving one component keeps the others' legacy networks
+            report = Report.load(tmp)
+            data = np.random.rand(20, Report.inputs + Report.outputs)
+            np.save(join(report.dir, 'training', 'data.npy'), data)
+            report.train(2, 0, 0.0, batch=8)
+            loaded = Agent.load(tmp)
+            for a, b in zip(agent.surveying.weights(),
+                            loaded.surveying.weights()):
+                self.assertTrue((a == b).all())
+            for a, b in zip(report.weights(), loaded.report.weights()):
+                self.assertTrue((a == b).all())
+        finally:
+            shutil.rmtree(tmp)
+
+
+class ComponentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_train_stream(self):
+        report = Report.init(self.dir)
+        data = np.random.rand(50, Report.inputs + Report.outputs)
+        np.save(join(report.dir, 'training', 'data.npy'), data)
+        before = report.weights()
+        report.train(3, 0, 0.0, batch=8)
+        after = Report.load(self.dir).weights()
+        self.assertTrue(any((b != a).any() for b, a in zip(before, after)))
+
+    def test_update_settings(self):
+        report = Report.init(self.dir)
+        inp = np.random.rand(8, Report.inputs)
+        out = np.random.rand(8, Report.outputs)
+        before = report.weights()
+        # the component's settings are used unless others are given
+        report.lr = 0.0
+        report.update(inp, out)
+        self.assertTrue(all((b == a).all()
+                            for b, a in zip(before, report.weights())))
+        report.update(inp, out, lr=0.1)
+        self.assertTrue(any((b != a).any()
+                            for b, a in zip(before, report.weights())))
+
+
+class PredictionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_windows(self):
+        rows, cols = ProbabilityPrediction.windows((80, 24))
+        self.assertEquals(len(rows), 15 * 22)
+        covered = np.zeros((24, 80), dtype=bool)
+        for r, c in zip(rows, cols):
+            covered[r:r + 3, c:c + 10] = True
+        self.assertTrue(covered.all())
+        self.assertRaises(ValueError, ProbabilityPrediction.windows, (8, 3))
+
+    def test_theorize(self):
+        pred = ProbabilityPrediction.init(self.dir)
+        field = Simulator(DefaultTheme()).field(23, 7)
+        surveyed = np.random.rand(7, 23) < 0.2
+        theory = pred.theorize(field, surveyed)
+
+        known = pred.val_funcs[0].values(field)
+        values = np.where(surveyed, known, 0.0)
+        total = np.zeros((7, 23))
+        norm = np.zeros((7, 23))
+        for r, c in zip(*pred.windows((23, 7))):
+            out = pred.nn.sim([values[r:r + 3, c:c + 10].ravel()])
+            weight = surveyed[r:r + 3, c:c + 10].sum() + 1e-3
+            total[r:r + 3, c:c + 10] += out.reshape(3, 10) * weight
+            norm[r:r + 3, c:c + 10] += weight
+        expected = np.where(surveyed, known, total / norm)
+        self.assertTrue(np.allclose(theory, expected))
+
+    def test_reveal(self):
+        pred = ProbabilityPrediction.init(self.dir)
+        field = Simulator(DefaultTheme()).field(23, 7)
+        surveyed = np.zeros((7, 23), dtype=bool)
+        theory = pred.theory(field, surveyed)
+        for sites in [[(0, 0)], [(22, 6), (11, 3)], [(5, 2)]]:
+            windows = theory.windows(sites)
+            self.assertEquals(list(windows),
+                              [i for i, (r, c) in
+                               enumerate(zip(theory.rows, theory.cols))
+                               if any(r <= y < r + 3 and c <= x < c + 10
+                                      for x, y in sites)])
+            theory.reveal(sites)
+            for x, y in sites:
+                surveyed[y, x] = True
+            self.assertTrue(np.allclose(theory.values,
+                                        pred.theorize(field, surveyed)))
+
 
 class SurveyingTest(unittest.TestCase):
 
@@ -52,6 +222,18 @@ class SurveyingTest(unittest.TestCase):
 
         coords = surveying.choose(field)
         ## TODO some tests on the results
+
+    def test_choose_batch(self):
+        sim = Simulator(DefaultTheme())
+        fields = [sim.field(80, 24) for i in xrange(5)]
+
+        surveying = Surveying.load(dir)
+
+        coords = surveying.choose_batch(fields)
+        self.assertEquals(len(coords), 5)
+        for field, c in zip(fields, coords):
+            self.assertEquals(list(c), list(surveying.choose(field)))
+            self.assertTrue(0 <= c[0] < 80 and 0 <= c[1] < 24)
         
 
 class ReportTest(unittest.TestCase):
@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+from wcai import bench
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_run(self):
+        results = bench.run(batch=2, repeat=3, warmup=1)
+        self.assertEquals(sorted(results['benchmarks']),
+                          sorted(b[0] for b in bench.benchmarks))
+        for stats in results['benchmarks'].values():
+            self.assertTrue(stats['p50'] <= stats['p95'] <= stats['p99'])
+            self.assertTrue(stats['throughput'] > 0)
+
+        out = StringIO()
+        bench.report(results, out)
+        self.assertEquals(len(out.getvalue().splitlines()),
+                          len(bench.benchmarks) + 1)
+
+    def test_skip(self):
+        results = bench.run(['reduce', 'choose', 'sim'], width=40, height=12,
+                            repeat=3)
+        self.assertEquals(sorted(results['benchmarks']), ['reduce', 'sim'])
+        self.assertEquals(list(results['skipped']), ['choose'])
+
+        out = StringIO()
+        bench.report(results, out)
+        self.assertTrue('choose         skipped' in out.getvalue())
+
+    def test_save(self):
+        results = bench.run(['reduce', 'sim'], repeat=3)
+        self.assertEquals(sorted(results['benchmarks']), ['reduce', 'sim'])
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            bench.save(results, path)
+            with open(path) as f:
+                self.assertEquals(json.load(f), results)
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from os.path import join
+
+from wildcatting.model import Reservoir
+from wildcatting.theme import DefaultTheme
+
+from wcai.corpus import FieldCorpus
+from wcai.data import Simulator, SiteArrays
+
+
+class FieldCorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sim = Simulator(DefaultTheme())
+        self.corpus = FieldCorpus.create(self.dir, self.sim, 5, 20, 6, seed=7)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fields(self):
+        corpus = FieldCorpus(self.dir)
+        self.assertEquals(len(corpus), 5)
+        self.assertEquals((corpus.width, corpus.height), (20, 6))
+        for k in [3, 0, 4]:
+            field = SiteArrays(self.sim.field(20, 6, hash((7, k))))
+            stored = corpus.field(k)
+            for name in SiteArrays.getters.keys() + ['reservoir']:
+                self.assertTrue(np.array_equal(getattr(stored, name),
+                                               getattr(field, name)), name)
+
+    def test_oil_field(self):
+        field = self.corpus.field(1)
+        rows, cols = np.nonzero(field.reservoir == field.reservoir.max())
+        sites = [field.getSite(r, c) for r, c in zip(rows, cols)]
+        reservoir = sites[0].getReservoir()
+        self.assertTrue(all(s.getReservoir() is reservoir for s in sites))
+        self.assertEquals(reservoir.getReserves(),
+                          field.reserves[rows[0], cols[0]])
+        self.assertEquals(sites[0].getProbability(),
+                          field.prob[rows[0], cols[0]])
+        self.assertTrue(isinstance(reservoir, Reservoir))
+
+    def test_stand_ins(self):
+        # corpora written without their reservoirs still build fields
+        os.remove(join(self.dir, 'reservoirs.pkl'))
+        field = FieldCorpus(self.dir).field(1)
+        rows, cols = np.nonzero(field.reservoir >= 0)
+        reservoir = field.getSite(rows[0], cols[0]).getReservoir()
+        self.assertEquals(reservoir.getReserves(),
+                          field.reserves[rows[0], cols[0]])
+
+    def test_sample(self):
+        fields = self.corpus.sample(8, np.random.RandomState(0))
+        self.assertEquals(len(fields), 8)
+        self.assertEquals(fields[0].prob.shape, (6, 20))
+
+    def test_incomplete(self):
+        self.assertRaises(ValueError, FieldCorpus, tempfile.gettempdir())
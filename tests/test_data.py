@@ -1,10 +1,18 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
 from wildcatting.model import OilField, Site
 from wildcatting.game import (Filler, OilFiller, DrillCostFiller, 
                               ReservoirFiller, PotentialOilDepthFiller)
 from wildcatting.theme import DefaultTheme
-from wcai.data import Region, OilProbability, UtilityEstimator
+from wcai.data import (Simulator, Region, OilProbability, DrillCost, Taxes,
+                       OilValue, OilReserves, OilPresence, ReservoirSize,
+                       UtilityEstimator, SiteArrays, TrainingData,
+                       FieldModel, data_header, load_data)
 
 
 theme = DefaultTheme()
@@ -44,6 +52,114 @@ class RegionTest(unittest.TestCase):
             for i in xrange(30):
                 self.assertEquals(region.sites[i]['prob'], 10.0)
 
+    def test_array_layout(self):
+        field = OilField(20, 6)
+        AlternatingFiller().fill(field)
+        map = Region.map(field, val_funcs)
+        self.assertEquals(map.values.shape, (6, 20, 1))
+        self.assertEquals(map.site(1, 3), {'prob': 10.0})
+        self.assertEquals(map.sites[20], map.site(1, 0))
+        inputs = map.inputs(['prob'])
+        self.assertEquals(len(inputs), 120)
+        self.assertEquals(list(inputs[:2]), [0.0, 0.0])
+        self.assertEquals(list(inputs[20:22]), [10.0, 10.0])
+
+    def test_reduce_matches_avgs(self):
+        for scale, width, height in [(8, 80, 24), (4, 40, 12), (2, 20, 6)]:
+            field = OilField(width, height)
+            OilFiller(theme).fill(field)
+            map = Region.map(field, val_funcs)
+            region = Region.reduce(map, scale)
+            fwh = 2.0 * np.array(map.wh) / (np.array(region.wh) + 1.0)
+            ox, oy = fwh / 2.0
+            for y in xrange(region.wh[1]):
+                for x in xrange(region.wh[0]):
+                    avgs = Region.avgs(x * ox, y * oy, fwh, map)
+                    self.assertAlmostEqual(region.site(y, x)['prob'],
+                                           avgs['prob'])
+
+    def test_pyramid(self):
+        field = OilField(80, 24)
+        OilFiller(theme).fill(field)
+        arrays = SiteArrays.of(field)
+        pyramid = arrays.pyramid(val_funcs)
+        self.assertTrue(arrays.pyramid(val_funcs) is pyramid)
+        for pos, size, scale in [((0, 0), (80, 24), 8), ((13, 5), (40, 12), 4),
+                                 ((59, 17), (20, 6), 2)]:
+            region = pyramid.region(pos, size)
+            map = Region.map(field, val_funcs, pos, size)
+            self.assertTrue(np.array_equal(region.values, map.values))
+            reduct = pyramid.reduce(region, scale)
+            self.assertTrue(pyramid.reduce(region, scale) is reduct)
+            self.assertTrue(np.allclose(reduct.values,
+                                        Region.reduce(map, scale).values))
+
+        field.getSite(0, 0).setProbability(100)
+        arrays.invalidate()
+        self.assertEquals(arrays.pyramid(val_funcs).full.site(0, 0)['prob'],
+                          100)
+
+    def test_partition_is_lazy(self):
+        field = OilField(80, 24)
+        OilFiller(theme).fill(field)
+        DrillCostFiller(theme).fill(field)
+        vfs = [OilProbability(theme, 80 * 24), DrillCost(theme, 80 * 24)]
+        parts = Region.partition(field, 8, vfs)
+        self.assertEquals(len(parts), 30)
+        mapping = parts[0].source
+        self.assertTrue(all(p.source is mapping for p in parts))
+        self.assertEquals(mapping.evaluated, set())
+
+        values = Region.evaluate(field, vfs, scale=8)
+        part = parts[13]
+        x, y = part.pos
+        self.assertTrue(np.array_equal(part.inputs(['cost']),
+                                       values[y:y + 3, x:x + 10, 1].ravel()))
+        self.assertEquals(mapping.evaluated, set(['cost']))
+        self.assertTrue(np.array_equal(part.values,
+                                       values[y:y + 3, x:x + 10]))
+        self.assertTrue(np.may_share_memory(part.values, mapping.values))
+
+    def test_view(self):
+        field = OilField(20, 6)
+        OilFiller(theme).fill(field)
+        map = Region.map(field, val_funcs)
+        view = map.view((1, 2), (5, 2), step=(3, 2))
+        self.assertEquals(view.pos, (1, 2))
+        self.assertEquals(view.size, (13, 3))
+        self.assertTrue(np.array_equal(view.values,
+                                       map.values[2:5:2, 1:14:3]))
+        inner = view.view((1, 1), (2, 1), step=(2, 1))
+        self.assertTrue(np.array_equal(inner.values,
+                                       map.values[4:5, 4:14:6]))
+
+    def test_slide(self):
+        values = np.arange(6 * 20 * 2.0).reshape(6, 20, 2)
+        region = Region(keys=['a', 'b'], values=values)
+        windows = region.slide((8, 4), (5, 2))
+        self.assertEquals(windows.shape, (2, 3, 4, 8, 2))
+        self.assertTrue(np.may_share_memory(windows, values))
+        for row in xrange(2):
+            for col in xrange(3):
+                self.assertTrue(np.array_equal(
+                    windows[row, col],
+                    values[row * 2:row * 2 + 4, col * 5:col * 5 + 8]))
+
+        for boundary in ['edge', 'wrap']:
+            windows = region.slide((8, 4), (5, 3), boundary)
+            self.assertEquals(windows.shape, (2, 4, 4, 8, 2))
+            padded = np.pad(values, ((0, 1), (0, 3), (0, 0)), boundary)
+            self.assertTrue(np.array_equal(windows[1, 3], padded[3:, 15:]))
+
+    def test_crops(self):
+        values = np.arange(6 * 20.0).reshape(6, 20, 1)
+        region = Region(keys=['a'], values=values)
+        crops = region.crops((8, 4), 50, rnd=np.random.RandomState(1))
+        self.assertEquals(crops.shape, (50, 4, 8, 1))
+        for crop in crops:
+            y, x = divmod(int(crop[0, 0, 0]), 20)
+            self.assertTrue(np.array_equal(crop, values[y:y + 4, x:x + 8]))
+
     def test_visualize(self):
         theme = DefaultTheme()
         for scale, width, height in [(4, 40, 12), (2, 20, 6)]:
@@ -59,5 +175,149 @@ class RegionTest(unittest.TestCase):
             print region
 
 
+class ValueFunctionTest(unittest.TestCase):
+
+    def test_values_match_value(self):
+        field = Simulator(theme).field(20, 6)
+        for cls in [OilProbability, DrillCost, Taxes, OilValue, OilReserves,
+                    OilPresence, ReservoirSize, UtilityEstimator]:
+            for norm in [False, True]:
+                vf = cls(theme, 20 * 6, normalize=norm)
+                values = vf.values(field, 2)
+                self.assertEquals(values.shape, (6, 20))
+                for row in xrange(6):
+                    for col in xrange(20):
+                        site = field.getSite(row, col)
+                        self.assertAlmostEqual(values[row, col],
+                                               vf.value(site, 2))
+
+
+class DataFileTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.rows = np.arange(12, dtype='<f4').reshape(3, 4)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_binary(self):
+        with open(self.path, 'wb') as f:
+            f.write(data_header(3, 1))
+            f.write(self.rows.tostring())
+        data = load_data(self.path, 3)
+        self.assertTrue(isinstance(data, np.memmap))
+        self.assertTrue(np.array_equal(data, self.rows))
+        self.assertRaises(ValueError, load_data, self.path, 2)
+
+    def test_npy(self):
+        with open(self.path, 'wb') as f:
+            np.save(f, self.rows)
+        self.assertTrue(np.array_equal(load_data(self.path), self.rows))
+
+    def test_text(self):
+        np.savetxt(self.path, self.rows[:1])
+        self.assertEquals(load_data(self.path).shape, (1, 4))
+
+
+class TrainingDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.rows = np.arange(44, dtype='<f4').reshape(11, 4)
+        self.paths = [os.path.join(self.dir, p) for p in ['a', 'b.npy']]
+        np.savetxt(self.paths[0], self.rows[:5])
+        np.save(self.paths[1], self.rows[5:])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_batches(self):
+        data = TrainingData(self.paths, 3, chunk=2, mix=2)
+        self.assertEquals(len(data), 11)
+        self.assertEquals(len(data.chunks), 6)
+        for epoch in xrange(2):
+            batches = list(data.batches(3))
+            self.assertTrue(all(len(i) <= 3 for i, o in batches))
+            inputs = np.concatenate([i for i, o in batches])
+            outputs = np.concatenate([o for i, o in batches])
+            self.assertEquals(outputs.shape, (11, 1))
+            order = np.argsort(outputs[:, 0])
+            self.assertTrue(np.array_equal(inputs[order], self.rows[:, :3]))
+
+
+def lag_correlation(x, axis):
+    a = np.rollaxis(x, axis)
+    a, b = a[:-1].ravel(), a[1:].ravel()
+    return np.corrcoef(a, b)[0, 1]
+
+
+class FieldModelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sim = Simulator(theme, fast=True)
+        cls.model = sim.model(80, 24)
+        ref = Simulator(theme)
+        cls.ref = [SiteArrays(ref.field(80, 24, seed=1000 + i))
+                   for i in xrange(40)]
+        cls.gen = cls.model.generate(40, 80, 24, np.random.RandomState(0))
+
+    def stack(self, fields, name):
+        return np.array([getattr(f, name) for f in fields], dtype=float)
+
+    def test_statistics(self):
+        for name in FieldModel.smooth:
+            ref, gen = self.stack(self.ref, name), self.stack(self.gen, name)
+            self.assertAlmostEqual(gen.mean() / ref.mean(), 1, delta=0.1)
+            self.assertAlmostEqual(gen.std() / ref.std(), 1, delta=0.1)
+            for axis in [1, 2]:
+                self.assertAlmostEqual(lag_correlation(gen, axis),
+                                       lag_correlation(ref, axis), delta=0.1)
+        # a few large reservoirs dominate the moments of site reserves
+        ref, gen = [np.concatenate([f.reserves[f.wet > 0] for f in fields])
+                    for fields in [self.ref, self.gen]]
+        for q in [25, 50, 75]:
+            self.assertAlmostEqual(np.percentile(gen, q) /
+                                   np.percentile(ref, q), 1, delta=0.15)
+        for name in ['oil', 'wet']:
+            ref, gen = self.stack(self.ref, name), self.stack(self.gen, name)
+            self.assertAlmostEqual(gen.mean(), ref.mean(), delta=0.02)
+
+        counts = [len(np.unique(f.reservoir[f.reservoir >= 0]))
+                  for f in self.ref]
+        self.assertAlmostEqual(np.mean([len(f.field.reservoirs)
+                                        for f in self.gen]) / np.mean(counts),
+                               1, delta=0.15)
+
+    def test_oil_field(self):
+        arrays = self.gen[0]
+        site = arrays.field.getSite(3, 5)
+        self.assertEquals(site.getProbability(), arrays.prob[3, 5])
+        self.assertEquals(site.getDrillCost(), arrays.cost[3, 5])
+        self.assertEquals(site.getTax(), arrays.tax[3, 5])
+        self.assertEquals(site.getPotentialOilDepth(), arrays.depth[3, 5])
+
+        rows, cols = np.nonzero(arrays.reservoir == arrays.reservoir.max())
+        sites = [arrays.field.getSite(r, c) for r, c in zip(rows, cols)]
+        reservoir = sites[0].getReservoir()
+        self.assertTrue(all(s.getReservoir() is reservoir for s in sites))
+        self.assertEquals(reservoir.getReserves(),
+                          arrays.reserves[rows[0], cols[0]])
+
+    def test_seeded(self):
+        sim = Simulator(theme, fast=True)
+        a, b = [sim.field(80, 24, seed=7) for i in xrange(2)]
+        for name in ['prob', 'oil', 'reservoir', 'reserves']:
+            self.assertTrue(np.array_equal(getattr(a, name),
+                                           getattr(b, name)))
+
+    def test_shared(self):
+        sim = Simulator(theme, fast=True, models={(80, 24): self.model})
+        self.assertTrue(sim.model(80, 24) is self.model)
+        self.assertEquals(sim.field(80, 24).prob.shape, (24, 80))
+
+
 if __name__ == "__main__":
     unittest.main()
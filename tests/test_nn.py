@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import neurolab as nl
+
+from wcai.nn import MLP, SGD, WeightStore, Checkpoint
+
+
+class MLPTest(unittest.TestCase):
+
+    def test_matches_neurolab(self):
+        for transf in [None, [nl.trans.LogSig(), nl.trans.PureLin()]]:
+            net = nl.net.newff([[0.0, 1.0]] * 6, [4, 3], transf)
+            nl.init.init_rand(net.layers[0])
+            nl.init.init_rand(net.layers[1])
+            inputs = np.random.rand(20, 6)
+            outputs = MLP(net).sim(inputs)
+            self.assertEquals(outputs.shape, (20, 3))
+            self.assertTrue(np.allclose(outputs, net.sim(inputs)))
+
+    def test_shared_weights(self):
+        net = nl.net.newff([[0.0, 1.0]] * 2, [2, 1])
+        mlp = MLP(net)
+        net.layers[1].np['w'][:] = 0
+        net.layers[1].np['b'][:] = 0.5
+        self.assertTrue(np.allclose(mlp.sim([[0.3, 0.7]]), np.tanh(0.5)))
+
+    def test_bad_inputs(self):
+        net = nl.net.newff([[0.0, 1.0]] * 2, [2, 1])
+        self.assertRaises(ValueError, MLP(net).sim, [[0.0, 1.0, 2.0]])
+
+
+class SGDTest(unittest.TestCase):
+
+    def net(self):
+        net = nl.net.newff([[0.0, 1.0]] * 3, [4, 2],
+                           [nl.trans.TanSig(), nl.trans.LogSig()])
+        nl.init.init_rand(net.layers[0])
+        nl.init.init_rand(net.layers[1])
+        return net
+
+    def test_gradients(self):
+        net = self.net()
+        sgd = SGD(net)
+        inputs, targets = np.random.rand(8, 3), np.random.rand(8, 2)
+        grads, loss = sgd.gradients(inputs, targets)
+        # compare against central differences
+        eps = 1e-6
+        for p, g in zip(sgd.params, grads):
+            for i in np.ndindex(p.shape):
+                p[i] += eps
+                up = sgd.gradients(inputs, targets)[1]
+                p[i] -= 2 * eps
+                down = sgd.gradients(inputs, targets)[1]
+                p[i] += eps
+                self.assertAlmostEquals(g[i], (up - down) / (2 * eps), 5)
+
+    def test_step(self):
+        net = self.net()
+        mlp = MLP(net)
+        sgd = SGD(net)
+        inputs, targets = np.random.rand(16, 3), np.random.rand(16, 2)
+        before = mlp.sim(inputs)
+        losses = [sgd.step(inputs, targets, lr=0.1) for i in xrange(200)]
+        self.assertTrue(losses[-1] < losses[0])
+        # the network's own arrays are updated
+        self.assertFalse(np.allclose(mlp.sim(inputs), before))
+        self.assertTrue(np.allclose(mlp.sim(inputs), net.sim(inputs)))
+
+    def test_clip(self):
+        net = self.net()
+        sgd = SGD(net)
+        before = [p.copy() for p in sgd.params]
+        sgd.step(np.random.rand(4, 3), np.ones((4, 2)) * 10, lr=1.0,
+                 momentum=0.0, clip=0.01)
+        norm = np.sqrt(sum(np.square(p - b).sum()
+                           for p, b in zip(sgd.params, before)))
+        self.assertTrue(norm <= 0.01 + 1e-9)
+
+
+class WeightStoreTest(unittest.TestCase):
+
+    def test_publish(self):
+        weights = [np.random.rand(4, 6), np.random.rand(4)]
+        store = WeightStore.create([w.shape for w in weights])
+        try:
+            reader = WeightStore(store.path, store.shapes)
+            self.assertEquals(reader.version, 0)
+            self.assertEquals(store.publish(weights), 1)
+            self.assertEquals(reader.version, 1)
+            arrays = reader.arrays()
+            for a, w in zip(arrays, weights):
+                self.assertTrue((a == w).all())
+            self.assertFalse(arrays[0].flags.writeable)
+
+            # arrays of earlier versions survive later publishes
+            store.publish([w + 1 for w in weights])
+            for a, w in zip(arrays, weights):
+                self.assertTrue((a == w).all())
+            self.assertTrue((reader.arrays()[1] == weights[1] + 1).all())
+            reader.close()
+        finally:
+            store.close(unlink=True)
+
+    def test_intact(self):
+        weights = [np.zeros(3)]
+        store = WeightStore.create([w.shape for w in weights], slots=3)
+        try:
+            version = store.publish(weights)
+            self.assertTrue(store.intact(version))
+            store.publish(weights)
+            self.assertTrue(store.intact(version))
+            # the next publish may be writing over the version's slot
+            store.publish(weights)
+            self.assertFalse(store.intact(version))
+        finally:
+            store.close(unlink=True)
+
+    def test_not_a_store(self):
+        f = tempfile.NamedTemporaryFile()
+        f.write('\0' * 128)
+        f.flush()
+        self.assertRaises(ValueError, WeightStore, f.name, [(4,)])
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'agent.ckpt')
+        self.nets = {'a': nl.net.newff([[0, 1]] * 3, [4, 2]),
+                     'b': nl.net.newff([[-1, 1]] * 2, [3, 1],
+                                       [nl.trans.TanSig(),
+                                        nl.trans.PureLin()])}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        Checkpoint.save(self.path, self.nets, {'step': 12})
+        nets, meta = Checkpoint.load(self.path)
+        self.assertEquals(meta, {'step': 12})
+        self.assertEquals(sorted(nets), ['a', 'b'])
+        inputs = np.random.rand(5, 2)
+        self.assertTrue(np.allclose(MLP(nets['b']).sim(inputs),
+                                    self.nets['b'].sim(inputs)))
+        self.assertTrue(isinstance(nets['b'].layers[1].transf,
+                                   nl.trans.PureLin))
+        self.assertTrue(np.array_equal(nets['a'].inp_minmax,
+                                       self.nets['a'].inp_minmax))
+
+    def test_copy_on_write(self):
+        Checkpoint.save(self.path, self.nets)
+        nets, meta = Checkpoint.load(self.path)
+        w = nets['a'].layers[0].np['w']
+        w += 1
+        again = Checkpoint.load(self.path)[0]['a'].layers[0].np['w']
+        self.assertTrue(np.allclose(w - 1, again))
+
+    def test_atomic(self):
+        Checkpoint.save(self.path, self.nets, {'step': 1})
+        with open(self.path, 'rb') as f:
+            before = f.read()
+        broken = nl.net.newff([[0, 1]] * 3, [4, 2])
+        broken.layers[1].np['b'] = np.array(['x', 'y'])
+        self.assertRaises(ValueError, Checkpoint.save, self.path,
+                          dict(self.nets, c=broken), {'step': 2})
+        with open(self.path, 'rb') as f:
+            self.assertEquals(f.read(), before)
+        self.assertEquals(os.listdir(self.dir), ['agent.ckpt'])
+
+    def test_not_a_checkpoint(self):
+        with open(self.path, 'wb') as f:
+            f.write('\0' * 128)
+        self.assertRaises(ValueError, Checkpoint.load, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from wcai.replay import ReplayBuffer
+
+
+class ReplayBufferTest(unittest.TestCase):
+
+    def test_ring(self):
+        buf = ReplayBuffer(2, 5)
+        for i in xrange(3):
+            buf.add(np.ones((2, 2)) * i, [0, 1], [i, i])
+        self.assertEquals(len(buf), 5)
+        # the oldest transition has been replaced
+        self.assertEquals(sorted(buf.rewards), [0.0, 1.0, 1.0, 2.0, 2.0])
+        self.assertTrue(buf.done.all())
+        inputs, actions, rewards, next_inputs, done = buf.batch([4, 0])
+        self.assertTrue((inputs == 2).all())
+        self.assertEquals(list(actions), [0, 1])
+
+        buf.add(np.zeros((7, 2)), np.zeros(7), np.arange(7))
+        self.assertEquals(sorted(buf.rewards), [2.0, 3.0, 4.0, 5.0, 6.0])
+
+    def test_next_inputs(self):
+        buf = ReplayBuffer(2, 4)
+        buf.add(np.zeros((2, 2)), [0, 0], [1.0, 2.0], np.ones((2, 2)),
+                [False, True])
+        self.assertTrue((buf.next_inputs[:2] == 1).all())
+        self.assertEquals(list(buf.done[:2]), [False, True])
+
+    def test_sample(self):
+        buf = ReplayBuffer(1, 100)
+        self.assertRaises(ValueError, buf.sample, 1)
+        buf.add(np.zeros((10, 1)), np.zeros(10), np.arange(10))
+        i = buf.sample(1000)
+        self.assertTrue(((i >= 0) & (i < 10)).all())
+
+        buf.update_priorities(np.arange(10), 0.0)
+        buf.update_priorities([3], 1.0)
+        i, weights = buf.sample_prioritized(50)
+        self.assertTrue((i == 3).all())
+        self.assertTrue(np.allclose(weights, 1.0))
+
+    def test_max_priority(self):
+        buf = ReplayBuffer(1, 4)
+        buf.add(np.zeros((2, 1)), np.zeros(2), np.zeros(2))
+        self.assertEquals(list(buf.priorities[:2]), [1.0, 1.0])
+        buf.update_priorities([1], 3.0)
+        buf.add(np.zeros((1, 1)), np.zeros(1), np.zeros(1))
+        self.assertEquals(buf.priorities[2], 3.0)
+        buf.add(np.zeros((1, 1)), np.zeros(1), np.zeros(1), priorities=5.0)
+        # the highest priority is kept once its transition is replaced
+        buf.add(np.zeros((4, 1)), np.zeros(4), np.zeros(4))
+        self.assertEquals(list(buf.priorities), [5.0] * 4)
+
+    def test_persist(self):
+        dir = tempfile.mkdtemp()
+        try:
+            buf = ReplayBuffer(3, 10, dir)
+            buf.add(np.ones((4, 3)), np.ones(4), np.arange(4))
+            buf.flush()
+            del buf
+            buf = ReplayBuffer(3, 10, dir)
+            self.assertEquals(len(buf), 4)
+            self.assertEquals(list(buf.rewards[:4]), [0.0, 1.0, 2.0, 3.0])
+            buf.update_priorities([0], 2.0)
+            buf.flush()
+            del buf
+            buf = ReplayBuffer(3, 10, dir)
+            self.assertEquals(buf.max_priority[0], 2.0)
+
+            # the most recent transitions are kept at another capacity
+            buf.add(np.zeros((8, 3)), np.zeros(8), np.arange(4, 12))
+            buf.flush()
+            del buf
+            buf = ReplayBuffer(3, 5, dir)
+            self.assertEquals(len(buf), 5)
+            self.assertEquals(list(buf.rewards), [7.0, 8.0, 9.0, 10.0, 11.0])
+            self.assertEquals(buf.max_priority[0], 2.0)
+            buf.flush()
+            del buf
+            buf = ReplayBuffer(3, 20, dir)
+            self.assertEquals(list(buf.rewards[:len(buf)]),
+                              [7.0, 8.0, 9.0, 10.0, 11.0])
+            buf.add(np.zeros((1, 3)), [0], [12.0])
+            self.assertEquals(buf.rewards[5], 12.0)
+            self.assertRaises(ValueError, ReplayBuffer, 2, 10, dir)
+        finally:
+            shutil.rmtree(dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from wildcatting.theme import DefaultTheme
+
+from wcai.agent import Agent
+from wcai.corpus import FieldCorpus
+from wcai.data import Simulator
+from wcai.selfplay import Games, site_returns, MAX_DEPTH
+
+
+class SiteReturnsTest(unittest.TestCase):
+
+    def test_returns(self):
+        sites = np.array([3, 1, 3, 1, 3])
+        seqs = np.array([0, 1, 2, 3, 4])
+        rewards = np.array([1.0, 2.0, 4.0, 8.0, 16.0])
+        self.assertEquals(list(site_returns(sites, seqs, rewards)),
+                          [21.0, 10.0, 20.0, 8.0, 16.0])
+
+
+class GamesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.agent = Agent.init(cls.dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_play(self):
+        games = Games(self.agent, DefaultTheme(), count=4, weeks=20,
+                      epsilon=0.5, seed=1)
+        for i in xrange(3):
+            profits = games.play()
+            self.assertEquals(profits.shape, (4,))
+            t = games.transitions
+            self.assertEquals(t['surveying'].ct, 4 * 20)
+            self.assertTrue(t['report'].ct <= 4 * 20)
+            self.assertTrue(t['drilling'].ct <= 4 * 20 * MAX_DEPTH)
+            self.assertTrue((games.well_ct <= games.drilled.sum(1)).all())
+            rewards = sum(t[c].rewards[:t[c].ct].sum() for c in t)
+            self.assertAlmostEqual(profits.sum(), rewards)
+
+    def test_lockstep_matches_single(self):
+        theme = DefaultTheme()
+        sim = Simulator(theme)
+        fields = [sim.field(80, 24) for i in xrange(3)]
+        together = Games(self.agent, theme, count=3, weeks=10)
+        alone = Games(self.agent, theme, count=1, weeks=10)
+        # replay the same oil prices for every game
+        price = theme.getOilPrices()._price
+        random.seed(1)
+        profits = together.play(fields)
+        for i, field in enumerate(fields):
+            theme.getOilPrices()._price = price
+            random.seed(1)
+            self.assertAlmostEqual(alone.play([field])[0], profits[i])
+
+    def test_corpus(self):
+        dir = tempfile.mkdtemp()
+        try:
+            theme = DefaultTheme()
+            corpus = FieldCorpus.create(dir, Simulator(theme), 3, seed=1)
+            games = Games(self.agent, theme, count=4, weeks=10, seed=1,
+                          corpus=corpus)
+            self.assertEquals(games.play().shape, (4,))
+            probs = [f.prob for f in games.fields]
+            self.assertTrue(all(any(np.array_equal(p, corpus.field(k).prob)
+                                    for k in xrange(3)) for p in probs))
+        finally:
+            shutil.rmtree(dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
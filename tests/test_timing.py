@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import neurolab as nl
+
+from wcai import timing
+from wcai.nn import MLP
+
+
+class TimingTest(unittest.TestCase):
+
+    def setUp(self):
+        timing.reset()
+
+    def tearDown(self):
+        timing.enable(False)
+        timing.reset()
+
+    def test_disabled(self):
+        with timing.timed('stage'):
+            timing.count('items', 3)
+        self.assertEquals(timing.stats(), {})
+
+    def test_enabled(self):
+        timing.enable()
+        for i in xrange(2):
+            with timing.timed('stage'):
+                timing.count('items', 3)
+        stats = timing.stats()
+        self.assertEquals(stats['stage']['count'], 2)
+        self.assertTrue(stats['stage']['seconds'] >= 0)
+        self.assertEquals(stats['items'], {'count': 6, 'seconds': 0.0})
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            timing.dump(path)
+            with open(path) as f:
+                self.assertEquals(json.load(f), stats)
+        finally:
+            os.remove(path)
+
+    def test_nn(self):
+        timing.enable()
+        net = nl.net.newff([[0.0, 1.0]] * 2, [2, 1])
+        MLP(net).sim(np.zeros((5, 2)))
+        self.assertEquals(timing.stats()['nn.rows']['count'], 5)
+        self.assertEquals(timing.stats()['nn.sim']['count'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,16 @@
+import os
+import shutil
+import tempfile
 import unittest
+import zlib
+
+import numpy as np
+
+from StringIO import StringIO
 
 import wcdata.control
-from wcdata.commands import OilPriceCommand, FieldCommand
+from wcai.data import load_data
+from wcdata.commands import OilPriceCommand, FieldCommand, CorpusCommand
 
 
 class ControlTest(unittest.TestCase):
@@ -16,3 +25,100 @@ class OilPriceCommandTest(unittest.TestCase):
 class FieldCommandTest(unittest.TestCase):
     def test_init(self):
         fc = FieldCommand()
+
+    def write(self, *argv):
+        args = wcdata.control.parser.parse_args(
+            ['field', '--width', '20', '--height', '6', '--num', '5',
+             '--no-headers'] + list(argv))
+        out = StringIO()
+        FieldCommand.writer(args).write(out)
+        return out.getvalue()
+
+    def test_seed(self):
+        rows = self.write('--seed', '7')
+        self.assertEquals(len(rows.splitlines()), 5)
+        self.assertEquals(rows, self.write('--seed', '7'))
+        self.assertEquals(rows, self.write('--seed', '7', '--workers', '2'))
+        self.assertNotEquals(rows, self.write('--seed', '8'))
+
+    def test_delim(self):
+        rows = self.write('--seed', '7')
+        lines = self.write('--seed', '7', '--delim', ',')[:-1].split('\n')
+        self.assertEquals(len(lines), 5)
+        self.assertEquals(lines[0].count(','), 20 * 6 * 3 - 1)
+        self.assertEquals(rows.replace(' ', ','), '\n'.join(lines) + '\n')
+
+    def test_compress(self):
+        rows = self.write('--seed', '7', '--buffer', '100')
+        gz = self.write('--seed', '7', '--compress', 'gzip')
+        self.assertEquals(zlib.decompress(gz, 16 + zlib.MAX_WBITS), rows)
+
+    def test_corpus(self):
+        dir = tempfile.mkdtemp()
+        try:
+            args = wcdata.control.parser.parse_args(
+                ['corpus', dir, '--width', '20', '--height', '6', '--num',
+                 '3', '--seed', '7'])
+            CorpusCommand.run(args)
+            rows = self.write('--corpus', dir).splitlines()
+            # fields wrap around the corpus
+            self.assertEquals(rows[3:], rows[:2])
+            seeded = self.write('--seed', '7').splitlines()
+            self.assertEquals(rows[:3], seeded[:3])
+        finally:
+            shutil.rmtree(dir)
+
+    def test_window(self):
+        rows = np.loadtxt(StringIO(self.write('--seed', '7', '--window',
+                                              '8x4', '--stride', '4,2')))
+        self.assertEquals(rows.shape, (5 * 4 * 2, 8 * 4 * 3))
+        fields = np.loadtxt(StringIO(self.write('--seed', '7')))
+        # the second window of the first field, prob and cost then wet
+        ins = fields[0, :240].reshape(6, 20, 2)
+        outs = fields[0, 240:].reshape(6, 20, 1)
+        self.assertTrue(np.allclose(rows[1], np.concatenate(
+            [ins[0:4, 4:12].ravel(), outs[0:4, 4:12].ravel()])))
+
+        rows = self.write('--seed', '7', '--window', '8x4', '--crops', '3',
+                          '--boundary', 'wrap')
+        self.assertEquals(len(rows.splitlines()), 5 * 3)
+
+    def test_window_errors(self):
+        for argv in [['--window', '30x3'],
+                     ['--window', '10x8', '--crops', '2'],
+                     ['--window', '8x4', '--crops', '2', '--stride', '1,1'],
+                     ['--window', '8x4', '--partition', '2']]:
+            args = wcdata.control.parser.parse_args(
+                ['field', '--width', '20', '--height', '6'] + argv)
+            self.assertRaises(SystemExit, FieldCommand.run, args)
+
+    def test_binary_widths(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'data')
+            with open(path, 'wb') as f:
+                args = wcdata.control.parser.parse_args(
+                    ['field', '--width', '80', '--height', '24', '--num', '2',
+                     '--partition', '8', '--reduce', '2', '--format',
+                     'binary'])
+                FieldCommand.writer(args).write(f)
+            # 10x3 partitions reduced to 5x1, of prob and cost then wet
+            self.assertEquals(load_data(path, 10).shape, (60, 15))
+
+            with open(path, 'wb') as f:
+                args = wcdata.control.parser.parse_args(
+                    ['field', '--width', '20', '--height', '6', '--num', '2',
+                     '--window', '10x3', '--reduce', '2', '--format',
+                     'binary'])
+                FieldCommand.writer(args).write(f)
+            self.assertEquals(load_data(path, 10).shape, (2 * 4 * 3, 15))
+        finally:
+            shutil.rmtree(dir)
+
+        text = StringIO()
+        args = wcdata.control.parser.parse_args(
+            ['field', '--width', '20', '--height', '6', '--window', '10x3',
+             '--reduce', '2'])
+        FieldCommand.writer(args).write(text)
+        lines = text.getvalue().splitlines()
+        self.assertEquals(len(lines[0].split()), len(lines[1].split()))
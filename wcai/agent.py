@@ -1,15 +1,29 @@
+import Queue
+import logging
+import multiprocessing
 import os
 import random
+import time
+import traceback
 import numpy as np
 import neurolab as nl
 
-from os.path import join, exists
+from numpy.lib.stride_tricks import as_strided
+from os.path import join, exists, dirname
 
 from wildcatting.theme import DefaultTheme
 
-from .data import OilProbability, DrillCost, Region
+from . import timing
+from .corpus import FieldCorpus
+from .data import (OilProbability, DrillCost, SiteArrays, Simulator,
+                   TrainingData, load_data)
+from .nn import MLP, SGD, WeightStore, Checkpoint
+from .replay import ReplayBuffer
+from .selfplay import Games, WEEKS, WIDTH, HEIGHT
 
 
+log = logging.getLogger("wcai")
+
 theme = DefaultTheme()
 
 
@@ -25,7 +39,30 @@ theme = DefaultTheme()
 # than will be provided at gameplay time. Additional initially zero-weighted
 # inputs may be inserted with the weights for those inputs learned only
 # through RL.
+#
+# The networks of all of an agent's components are saved together in the
+# agent's checkpoint file. Agents from before checkpoints kept each network
+# pickled in its component's utility.net, which is read when there is no
+# checkpoint, until the agent is imported into one.
+CHECKPOINT = 'agent.ckpt'
+LEGACY_NET = 'utility.net'
+
+
+def legacy_nets(agent):
+    """The networks of an agent's components kept in utility.net files"""
+    nets = {}
+    for name in os.listdir(agent):
+        if exists(join(agent, name, LEGACY_NET)):
+            nets[name] = nl.load(join(agent, name, LEGACY_NET))
+    return nets
+
+
 class Component:
+    # minibatch gradient descent settings for reinforcement
+    lr = 0.01
+    momentum = 0.9
+    clip = 1.0
+
     @classmethod
     def init(cls, agent):
         comp = cls(join(agent, cls.name))
@@ -43,31 +80,132 @@ class Component:
         return comp
 
     @classmethod
-    def load(cls, agent):
+    def load(cls, agent, nets=None):
         dir = join(agent, cls.name)
         comp = cls(dir)
-        comp.nn = nl.load(join(dir, 'utility.net'))
+        if nets is None and exists(join(agent, CHECKPOINT)):
+            nets = Checkpoint.load(join(agent, CHECKPOINT))[0]
+        if nets is not None and cls.name in nets:
+            comp.nn = nets[cls.name]
+        else:
+            comp.nn = nl.load(join(dir, LEGACY_NET))
         return comp
 
     def __init__(self, dir):
         self.dir = dir
+        self.mlp = None
+        self.sgd = None
+
+    def sim(self, inputs):
+        """Evaluate the network on a batch of input vectors"""
+        if self.mlp is None:
+            self.mlp = MLP(self.nn)
+        return self.mlp.sim(inputs)
 
     def save(self):
-        self.nn.save(join(self.dir, 'utility.net'))
+        """Save the network into its agent's checkpoint
+
+        The checkpoint of a legacy agent is started with the networks of its
+        other components, so that none are left behind in utility.net files.
+        """
+        path = join(dirname(self.dir), CHECKPOINT)
+        if exists(path):
+            nets, meta = Checkpoint.load(path)
+        else:
+            nets, meta = legacy_nets(dirname(self.dir)), {}
+        nets[self.name] = self.nn
+        Checkpoint.save(path, nets, meta)
+
+    def weights(self):
+        """Copies of the network's weight and bias arrays, layer by layer"""
+        return [l.np[p].copy() for l in self.nn.layers for p in ['w', 'b']]
+
+    def buffer(self, capacity):
+        """The component's replay buffer, kept in its directory"""
+        return ReplayBuffer(self.inputs, capacity, join(self.dir, 'replay'))
+
+    def bind(self, weights):
+        """Use the given arrays as the network's weights, without copying"""
+        weights = iter(weights)
+        for l in self.nn.layers:
+            for p in ['w', 'b']:
+                l.np[p] = next(weights)
+        self.mlp = None
+        self.sgd = None
+
+    def update(self, inputs, targets, lr=None, momentum=None, clip=None):
+        """Take one gradient step toward the targets of a minibatch
+
+        The network's weights are updated in place, keeping momentum between
+        calls. Settings not given are the component's. Returns the
+        minibatch's loss before the step.
+        """
+        if self.sgd is None:
+            self.sgd = SGD(self.nn)
+        return self.sgd.step(inputs, targets,
+                             self.lr if lr is None else lr,
+                             self.momentum if momentum is None else momentum,
+                             self.clip if clip is None else clip)
+
+    def reinforce(self, inputs, actions, utilities, epochs=1, batch=32):
+        """Train the utilities of the actions taken toward those observed
+
+        Outputs for the actions not taken are trained toward their current
+        values, so that only observed utilities move the network.
+        """
+        targets = self.sim(inputs)
+        targets[np.arange(len(actions)), actions] = utilities
+        for epoch in xrange(epochs):
+            with timing.timed('train.epoch'):
+                order = np.random.permutation(len(inputs))
+                for i in xrange(0, len(order), batch):
+                    j = order[i:i + batch]
+                    self.update(inputs[j], targets[j])
+
+    def train(self, epochs, show, goal, batch=None):
+        """Train on the files in the training directory
+
+        By default training is full batch rprop over all of the data at once.
+        Given a batch size, the data is instead streamed from disk as shuffled
+        minibatches for gradient descent, with the goal taken to be the mean
+        squared error of an epoch.
+        """
+        dir = join(self.dir, 'training')
+        if batch:
+            paths = [join(dir, tf) for tf in sorted(os.listdir(dir))]
+            self._stream(TrainingData(paths, self.inputs), epochs, show, goal,
+                         batch)
+            self.save()
+            return
 
-    def train(self, epochs, show, goal):
         inp = []
         out = []
-        # TODO support numpy binary datafiles
-        dir = join(self.dir, 'training')
-        for tf in os.listdir(dir):
-            data = np.loadtxt(join(dir, tf))
-            for d in data:
-                inp.append(d[:self.inputs])
-                out.append(d[self.inputs:])
-        nl.train.train_rprop(self.nn, inp, out, epochs=epochs, show=show,
-                             goal=goal)
-        self.nn.save(join(self.dir, 'utility.net'))
+        for tf in sorted(os.listdir(dir)):
+            data = load_data(join(dir, tf), self.inputs)
+            inp.append(data[:, :self.inputs])
+            out.append(data[:, self.inputs:])
+        inp = inp[0] if len(inp) == 1 else np.concatenate(inp)
+        out = out[0] if len(out) == 1 else np.concatenate(out)
+        with timing.timed('train.rprop'):
+            nl.train.train_rprop(self.nn, inp, out, epochs=epochs, show=show,
+                                 goal=goal)
+        # training replaces the network's weight arrays
+        self.mlp = None
+        self.sgd = None
+        self.save()
+
+    def _stream(self, data, epochs, show, goal, batch):
+        for epoch in xrange(1, epochs + 1):
+            loss = 0.0
+            with timing.timed('train.epoch'):
+                for inp, out in data.batches(batch):
+                    loss += self.update(inp, out) * len(inp)
+            loss /= len(data)
+            if show and epoch % show == 0:
+                log.info("Epoch: %s; Error: %s;", epoch, loss)
+            if loss <= goal:
+                log.info("The goal of learning is reached")
+                break
 
 
 class Surveying(Component):
@@ -79,49 +217,70 @@ class Surveying(Component):
     val_funcs = [OilProbability(theme, 80 * 24, normalize=True),
                  DrillCost(theme, 80 * 24, normalize=True)]
 
-    # Select the site to survey from a region of the correct size to apply
-    # directly to the NN. Chooses the site which corresponds to the highest
-    # output value of the NN.
-    def _choose_nn(self, region):
-        inputs = region.inputs(['prob', 'cost'])
-        outputs = self.nn.sim([inputs])[0]
-        print outputs
-        i = np.argmax(outputs)
-        print "Chose %s (%s)" % (i, outputs[i])
-        return i
-
-    # Choose a site to survey from the specified region of the field. The
-    # region here is always at 1:1 but varies in size. The scale is the factor
-    # by which the region must be reduced in order to apply the NN.
-    def _choose(self, region, scale):
-        if scale == 1:
-            i = self._choose_nn(region)
-            return region.pos + region.coords(i)
-
-        r = Region.reduce(region, scale)
-        print r
-        i = self._choose_nn(r)
+    # Select the sites to survey from regions of the correct size to apply
+    # directly to the NN, one per region. Chooses the site which corresponds
+    # to the highest output value of the NN for each region.
+    def _choose_nn(self, regions):
+        inputs = np.array([r.inputs(['prob', 'cost']) for r in regions])
+        outputs = self.sim(inputs)
+        choices = np.argmax(outputs, axis=1)
+        if log.isEnabledFor(logging.DEBUG):
+            for r, i, out in zip(regions, choices, outputs):
+                log.debug("Chose %s (%s) covering %s %s", i, out[i], *r.size)
+        return choices
+
+    # Zoom in on the half size region of the field centered on site i of the
+    # reduction of region. The region here is always at 1:1 but varies in
+    # size, and is sliced from the field's pyramid.
+    def _zoom(self, pyramid, region, reduct, i, scale):
         # map to field coordinates
-        c = region.pos + r.coords(i) * ([scale] * 2) + ([scale / 2] * 2)
+        c = region.pos + reduct.coords(i) * ([scale] * 2) + ([scale / 2] * 2)
         # zoom in on the subsequent region, keeping its border in bounds
         w, h = np.array(region.wh) / 2
         x = min(max(0, c[0] - w / 2), region.field.getWidth() - w - 1)
         y = min(max(0, c[1] - h / 2), region.field.getHeight() - h - 1)
 
-        map = Region.map(region.field, Surveying.val_funcs, (x, y), (w, h))
-        return self._choose(map, scale / 2)
+        return pyramid.region((x, y), (w, h))
 
     def choose(self, field):
         """Choose a site to survey in the specified field based on nn output"""
-        map = Region.map(field, Surveying.val_funcs)
-        coords = self._choose(map, 8)
-        return coords
+        return self.choose_batch([field])[0]
+
+    def choose_batch(self, fields):
+        """Choose a site to survey in each of the specified fields"""
+        regions, choices = self.descend(fields)
+        return [r.pos + r.coords(i) for r, i in zip(regions, choices)]
+
+    def descend(self, fields):
+        """Zoom in on each of the specified fields down to 1:1
+
+        Returns the final regions along with the index of the chosen site in
+        each. The fields move through each zoom level together, so that the
+        whole batch takes one NN evaluation per level. The scale is the factor
+        by which the regions must be reduced in order to apply the NN.
+
+        Each field's pyramid is kept by its SiteArrays, so that repeated
+        decisions on the same SiteArrays share their zoom levels.
+        """
+        pyramids = [SiteArrays.of(f).pyramid(Surveying.val_funcs)
+                    for f in fields]
+        regions = [p.full for p in pyramids]
+        scale = 8
+        while scale > 1:
+            reducts = [p.reduce(r, scale) for p, r in zip(pyramids, regions)]
+            choices = self._choose_nn(reducts)
+            regions = [self._zoom(p, r, reduct, i, scale)
+                       for p, r, reduct, i in zip(pyramids, regions, reducts,
+                                                  choices)]
+            scale /= 2
+
+        return regions, self._choose_nn(regions)
 
 
 class Report(Component):
     """Responsible for deciding whether to drill given a Surveyor's Report"""
     name = 'report'
-    inputs = 4   # prob, cost, tax
+    inputs = 4   # prob, cost, tax, oil price
     outputs = 2  # expected utility of drilling and of not drilling
 
 
@@ -166,30 +325,142 @@ class Sales(Component):
 #      outputs for each region that overlaps it. (weights are based on number
 #      of surveyed sites in the region)
 #  - profit
-class ProbabilityPrediction(Component):
-    """Theorize a probability distribution"""
-    name = 'probability'
+class Prediction(Component):
+    """Theorize a distribution from the windows of a partially known field"""
     inputs = 30
     outputs = 30
-    val_funcs = [OilProbability(theme, 30, normalize=True)]
+    # partition size as width, height
+    window = (10, 3)
 
-    def theorize(self, field):
-        pass
+    @classmethod
+    def windows(cls, size):
+        """Corners of the 50% overlapping windows covering a field of the
+        given width and height, as (rows, cols) arrays"""
+        (w, h), (ww, wh) = size, cls.window
+        if w < ww or h < wh:
+            raise ValueError("field %sx%s is smaller than a window" % (w, h))
+        xs = np.unique(np.r_[0:w - ww + 1:max(ww / 2, 1), w - ww])
+        ys = np.unique(np.r_[0:h - wh + 1:max(wh / 2, 1), h - wh])
+        rows, cols = np.meshgrid(ys, xs, indexing='ij')
+        return rows.ravel(), cols.ravel()
+
+    def theorize(self, field, surveyed):
+        """Theorize the normalized values of the sites of a field
+
+        Only the sites marked in the (height, width) surveyed mask are known.
+        Every window is applied to the NN with its unknown sites zeroed, and
+        each site is given the average of the outputs for the windows that
+        overlap it, weighted by the number of surveyed sites in each window.
+        Surveyed sites keep their known values.
+        """
+        return self.theory(field, surveyed).values
+
+    def theory(self, field, surveyed):
+        """A Theory of the field which may be revealed site by site"""
+        return Theory(self, field, surveyed)
+
+
+class Theory:
+    """A field's theorized values, kept up to date as sites are surveyed
+
+    The NN outputs and weight of every window are kept along with the
+    weighted sums they make for each site, so that revealing a site only
+    reevaluates the windows which overlap it and reblends the sites those
+    windows cover.
+    """
+
+    def __init__(self, pred, field, surveyed):
+        self.pred = pred
+        self.known = pred.val_funcs[0].values(SiteArrays.of(field))
+        self.surveyed = np.array(surveyed, dtype=bool)
+        self.inputs = np.where(self.surveyed, self.known, 0.0)
+        h, w = self.inputs.shape
+        ww, wh = pred.window
+
+        rows, cols = pred.windows((w, h))
+        self.rows, self.cols = rows, cols
+        self.ys, self.xs = np.unique(rows), np.unique(cols)
+        # (rows, cols, wh, ww) strided views of every window position
+        shape = (h - wh + 1, w - ww + 1, wh, ww)
+        self.view = as_strided(self.inputs, shape, self.inputs.strides * 2)
+        self.mask = as_strided(self.surveyed, shape,
+                               self.surveyed.strides * 2)
+        # flat index of the site under each window output
+        self.sites = ((rows * w + cols)[:, None] +
+                      (np.arange(wh)[:, None] * w + np.arange(ww)).ravel())
+
+        self.outputs, self.weights = self._evaluate(slice(None))
+        sites = self.sites.ravel()
+        self.total = np.bincount(sites, (self.outputs *
+                                         self.weights[:, None]).ravel(),
+                                 self.inputs.size)
+        self.norm = np.bincount(sites, np.repeat(self.weights, ww * wh),
+                                self.inputs.size)
+        self.values = np.where(self.surveyed, self.known,
+                               (self.total / self.norm).reshape(h, w))
+
+    def _evaluate(self, windows):
+        rows, cols = self.rows[windows], self.cols[windows]
+        outputs = self.pred.sim(self.view[rows, cols].reshape(len(rows), -1))
+        weights = self.mask[rows, cols].sum(axis=(1, 2)) + 1e-3
+        return outputs, weights
+
+    def windows(self, sites):
+        """Indices of the windows overlapping any of the (col, row) sites"""
+        ww, wh = self.pred.window
+        windows = []
+        for col, row in sites:
+            ys = np.arange(np.searchsorted(self.ys, row - wh + 1),
+                           np.searchsorted(self.ys, row, side='right'))
+            xs = np.arange(np.searchsorted(self.xs, col - ww + 1),
+                           np.searchsorted(self.xs, col, side='right'))
+            windows.append((ys[:, None] * len(self.xs) + xs).ravel())
+        return np.unique(np.concatenate(windows))
+
+    def reveal(self, sites):
+        """Mark the (col, row) sites surveyed and update the theory"""
+        if not len(sites):
+            return self.values
+        cols, rows = np.asarray(sites).T
+        self.surveyed[rows, cols] = True
+        self.inputs[rows, cols] = self.known[rows, cols]
+
+        windows = self.windows(sites)
+        sites = self.sites[windows]
+        # take back the windows' old contributions before adding the new
+        np.subtract.at(self.total, sites,
+                       self.outputs[windows] * self.weights[windows, None])
+        np.subtract.at(self.norm, sites, self.weights[windows, None])
+        outputs, weights = self._evaluate(windows)
+        np.add.at(self.total, sites, outputs * weights[:, None])
+        np.add.at(self.norm, sites, weights[:, None])
+        self.outputs[windows], self.weights[windows] = outputs, weights
+
+        cells = np.unique(sites)
+        values = self.values.reshape(-1)
+        values[cells] = np.where(self.surveyed.flat[cells],
+                                 self.known.flat[cells],
+                                 self.total[cells] / self.norm[cells])
+        return self.values
+
+
+class ProbabilityPrediction(Prediction):
+    """Theorize a probability distribution"""
+    name = 'probability'
+    val_funcs = [OilProbability(theme, 30, normalize=True)]
 
 
-class DrillCostPrediction(Component):
+class DrillCostPrediction(Prediction):
     """Theorize a drill cost distribution"""
     name = 'drill_cost'
-    inputs = 30
-    outputs = 30
-
-    def theorize(self, field):
-        pass
+    val_funcs = [DrillCost(theme, 30, normalize=True)]
 
 
 class Agent:
     cmps = [Surveying, Report, Drilling, Sales, ProbabilityPrediction,
             DrillCostPrediction]
+    # components trained by reinforcement learning
+    rl = [c.name for c in [Surveying, Report, Drilling, Sales]]
 
     @staticmethod
     def init(dir):
@@ -197,20 +468,244 @@ class Agent:
 
     @staticmethod
     def load(dir):
-        return Agent(dir, dict([(c.name, c.load(dir)) for c in Agent.cmps]))
+        """Load an agent from its checkpoint, or its components' legacy
+        networks if it has none"""
+        nets, meta = None, {}
+        if exists(join(dir, CHECKPOINT)):
+            nets, meta = Checkpoint.load(join(dir, CHECKPOINT))
+        return Agent(dir, dict([(c.name, c.load(dir, nets))
+                                for c in Agent.cmps]), meta.get('step', 0))
 
-    def __init__(self, dir, comps):
+    @staticmethod
+    def import_nets(dir):
+        """Save the components' legacy networks into the agent's checkpoint,
+        replacing any it had"""
+        nets = legacy_nets(dir)
+        agent = Agent(dir, dict([(c.name, c.load(dir, nets))
+                                 for c in Agent.cmps]))
+        agent.save()
+        return agent
+
+    def __init__(self, dir, comps, step=0):
         self.dir = dir
         self.comps = comps
         self.__dict__.update(comps)
+        # the number of self-play games learned from
+        self.step = step
 
     def save(self):
-        map(lambda x: x.save(self.dir), self.comps.values())
-
-    def learn(self):
-        ## TODO play one billion games
-        pass
+        """Atomically save every component into the agent's checkpoint"""
+        nets = dict((name, comp.nn) for name, comp in self.comps.items())
+        Checkpoint.save(join(self.dir, CHECKPOINT), nets, {'step': self.step})
+
+    def weights(self, names):
+        """Copies of the weight arrays of the named components, in order"""
+        return [w for name in names for w in self.comps[name].weights()]
+
+    def bind(self, names, weights):
+        """Use the arrays from weights as those of the named components"""
+        weights = iter(weights)
+        for name in names:
+            comp = self.comps[name]
+            comp.bind([next(weights) for l in comp.nn.layers for p in 'wb'])
+
+    def update(self, experience, names, buffers=None):
+        """Reinforce the named components with experience from self-play
+
+        Given replay buffers, the experience is added to each component's
+        buffer and the component is reinforced with as many transitions
+        sampled from the buffer instead.
+        """
+        for name in names:
+            inputs, actions, utilities = [np.concatenate(x) for x in
+                                          zip(*[e[name] for e in experience])]
+            if not len(inputs):
+                continue
+            if buffers:
+                # self-play utilities are the returns of whole games
+                buffers[name].add(inputs, actions, utilities)
+                i = buffers[name].sample(len(inputs))
+                inputs, actions, utilities = buffers[name].batch(i)[:3]
+            self.comps[name].reinforce(inputs, actions, utilities)
+
+    def learn(self, games, epsilon=0.1, batch=16, workers=1, sync=64,
+              components=None, replay=0, fast=False, corpus=None,
+              checkpoint=0):
+        """Play games against itself, updating components every sync games
+
+        With a replay capacity, updates sample from replay buffers holding
+        that many of each component's most recent decisions. If fast is
+        set, fields are generated by a fast Simulator, and given the path of
+        a FieldCorpus, they are instead drawn from the corpus. Given a
+        checkpoint interval, the agent is also saved whenever that many more
+        games have been learned from.
+
+        With more than one worker, games are played by actor processes
+        against the components' weights as last published to a shared weight
+        store, which is done after each update.
+        """
+        names = components or Agent.rl
+        batch = min(batch, games)
+        buffers = replay and dict([(name, self.comps[name].buffer(replay))
+                                   for name in names])
+        if workers > 1:
+            weights = self.weights(names)
+            # enough slots that a version is rarely reused while the slowest
+            # actor is still playing a batch against it
+            store = WeightStore.create([w.shape for w in weights],
+                                       slots=workers + 2)
+            store.publish(weights)
+            # actors share a field model fitted once here
+            sim = Simulator(theme, fast)
+            if fast and not corpus:
+                sim.model(WIDTH, HEIGHT)
+            try:
+                actors = Actors(self.dir, workers, batch, epsilon, store,
+                                names, fast, corpus, sim.models)
+                try:
+                    elapsed = self._learn(actors.experience, games, batch,
+                                          sync, names, buffers, checkpoint,
+                                          store)
+                finally:
+                    actors.close()
+            finally:
+                store.close(unlink=True)
+        else:
+            games_ = Games(self, theme, count=batch, epsilon=epsilon,
+                           fast=fast, corpus=corpus and FieldCorpus(corpus))
+
+            def play():
+                return games_.play(), games_.experience()
+
+            elapsed = self._learn(play, games, batch, sync, names, buffers,
+                                  checkpoint)
+        self.checkpoint(buffers)
+
+        played = -(-games // batch) * batch
+        log.info("Played %s games, %.0f weeks per second", played,
+                 played * WEEKS / elapsed)
+
+    def _learn(self, play, games, batch, sync, names, buffers, checkpoint,
+               store=None):
+        start = time.time()
+        pending = []
+        saved = self.step
+        for i in xrange(0, games, batch):
+            profits, experience = play()
+            log.debug("Games %s-%s: mean profit %s", i, i + batch - 1,
+                      profits.mean())
+            pending.append(experience)
+            if len(pending) * batch >= sync or i + batch >= games:
+                self.update(pending, names, buffers)
+                self.step += len(pending) * batch
+                pending = []
+                if store is not None:
+                    store.publish(self.weights(names))
+                if checkpoint and self.step - saved >= checkpoint:
+                    self.checkpoint(buffers)
+                    saved = self.step
+        return time.time() - start
+
+    def checkpoint(self, buffers=None):
+        """Save the agent along with any replay buffers"""
+        for buf in (buffers or {}).values():
+            buf.flush()
+        self.save()
+        log.debug("Saved %s after %s games", self.dir, self.step)
 
     def play(self, hostname, port):
         ## TODO connect to a game a play mercilessly
         pass
+
+
+class Actors:
+    """Self-play processes playing against the weights in a WeightStore
+
+    Each actor loads the agent from disk and attaches to the store, then plays
+    batches of games in lockstep, sending back the profits and experience of
+    each batch. Between batches, an actor switches its components over to the
+    store's arrays whenever a new version has been published. A batch played
+    on a version whose slot may have been reused by the time it finishes is
+    thrown away rather than sent back. An actor that fails sends back its
+    traceback, which is raised in the learner.
+    """
+
+    # seconds to wait on results before checking that the actors are alive
+    poll = 1.0
+
+    def __init__(self, dir, workers, batch, epsilon, store, names,
+                 fast=False, corpus=None, models=None):
+        self.results = multiprocessing.Queue()
+        self.stop = multiprocessing.Event()
+        self.procs = []
+        for i in xrange(workers):
+            seed = np.random.randint(1 << 31)
+            proc = multiprocessing.Process(target=_actor,
+                                           args=(dir, store.path,
+                                                 store.shapes, names,
+                                                 self.stop, self.results,
+                                                 batch, epsilon, seed,
+                                                 fast, corpus, models))
+            proc.daemon = True
+            proc.start()
+            self.procs.append(proc)
+
+    def experience(self):
+        while True:
+            try:
+                result = self.results.get(timeout=self.poll)
+            except Queue.Empty:
+                for proc in self.procs:
+                    if proc.exitcode is not None:
+                        raise RuntimeError("actor exited with code %s" %
+                                           proc.exitcode)
+                continue
+            if isinstance(result, basestring):
+                raise RuntimeError("actor failed:\n%s" % result)
+            if result is not None:
+                return result
+
+    def close(self):
+        self.stop.set()
+        # drain results so that every actor can flush its queue and exit
+        finished = 0
+        while finished < len(self.procs):
+            try:
+                if self.results.get(timeout=self.poll) is None:
+                    finished += 1
+            except Queue.Empty:
+                if not any(proc.is_alive() for proc in self.procs):
+                    break
+        for proc in self.procs:
+            proc.join()
+
+
+def _actor(dir, path, shapes, names, stop, results, batch, epsilon, seed,
+           fast, corpus, models):
+    try:
+        # forked actors would otherwise share the learner's random state
+        random.seed(seed)
+        np.random.seed(seed)
+        agent = Agent.load(dir)
+        games = Games(agent, theme, count=batch, epsilon=epsilon, seed=seed,
+                      fast=fast, corpus=corpus and FieldCorpus(corpus),
+                      models=models)
+        store = WeightStore(path, shapes)
+        try:
+            version = None
+            while not stop.is_set():
+                if store.version != version:
+                    version = store.version
+                    agent.bind(names, store.arrays(version))
+                profits = games.play()
+                if not store.intact(version):
+                    # the weights were overwritten while the games were played
+                    log.debug("Discarded games played on reused weights")
+                    continue
+                results.put((profits, games.experience()))
+        finally:
+            store.close()
+    except Exception:
+        results.put(traceback.format_exc())
+    finally:
+        results.put(None)
@@ -0,0 +1,139 @@
+import json
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+
+from wildcatting.theme import DefaultTheme
+
+from .agent import Surveying
+from .data import Simulator, Region
+
+
+# Each benchmark is set up for a field size and batch size by a function
+# returning the call to be timed and the number of items, such as fields or
+# input vectors, which that call processes. Set up functions are given a
+# scratch directory which is removed once the benchmarks have run, and raise
+# Skip for a field size they cannot be run at.
+class Skip(Exception):
+    pass
+
+
+def _map(dir, width, height, batch):
+    field = Simulator(DefaultTheme()).field(width, height)
+    # mapped regions are lazy, so time reading their values as well
+    return lambda: Region.map(field, Surveying.val_funcs).values, 1
+
+
+def _reduce(dir, width, height, batch):
+    if width < 8 or height < 8:
+        raise Skip("fields are reduced by a scale of 8")
+    field = Simulator(DefaultTheme()).field(width, height)
+    region = Region.map(field, Surveying.val_funcs)
+    return lambda: Region.reduce(region, 8), 1
+
+
+def _partition(dir, width, height, batch):
+    if width < 8 or height < 8:
+        raise Skip("fields are partitioned by a scale of 8")
+    field = Simulator(DefaultTheme()).field(width, height)
+    parts = (width / 8) * (height / 8)
+    keys = [vf.key for vf in Surveying.val_funcs]
+
+    # partitions are lazy, so time consuming them as well
+    def call():
+        for part in Region.partition(field, 8, Surveying.val_funcs):
+            part.inputs(keys)
+    return call, parts
+
+
+def _choose(dir, width, height, batch):
+    # surveying reduces fields to the 10x3 input of its NN by a scale of 8
+    if (width / 8, height / 8) != (10, 3):
+        raise Skip("surveying only chooses from fields of 80x24 to 87x31")
+    surveying = Surveying.init(dir)
+    sim = Simulator(DefaultTheme())
+    fields = [sim.field(width, height) for i in xrange(batch)]
+    return lambda: surveying.choose_batch(fields), batch
+
+
+def _sim(dir, width, height, batch):
+    surveying = Surveying.init(dir)
+    inputs = np.random.uniform(-1, 1, (batch, Surveying.inputs))
+    return lambda: surveying.sim(inputs), batch
+
+
+def _field_writer(dir, width, height, batch):
+    from StringIO import StringIO
+    import wcdata.control
+    from wcdata.commands import FieldCommand
+
+    args = wcdata.control.parser.parse_args(
+        ['field', '--width', str(width), '--height', str(height),
+         '--num', str(batch), '--no-headers', '--normalize'])
+    writer = FieldCommand.writer(args)
+    return lambda: writer.write(StringIO()), batch
+
+
+benchmarks = [('map', _map), ('reduce', _reduce), ('partition', _partition),
+              ('choose', _choose), ('sim', _sim),
+              ('field_writer', _field_writer)]
+
+
+def stats(times, items):
+    """Latency percentiles in ms and throughput in items per second"""
+    ms = np.array(times) * 1000.0
+    return {'p50': np.percentile(ms, 50), 'p95': np.percentile(ms, 95),
+            'p99': np.percentile(ms, 99), 'mean': ms.mean(),
+            'throughput': items * len(times) / float(sum(times))}
+
+
+def run(names=None, width=80, height=24, batch=16, repeat=100, warmup=3):
+    """Run the named benchmarks, by default all of them
+
+    Returns the settings along with the stats of each benchmark, suitable
+    for saving as JSON. Benchmarks which cannot be run at the field size are
+    skipped, with the reason kept in place of their stats.
+    """
+    results = {'width': width, 'height': height, 'batch': batch,
+               'repeat': repeat, 'benchmarks': {}, 'skipped': {}}
+    dir = tempfile.mkdtemp()
+    try:
+        for name, setup in benchmarks:
+            if names and name not in names:
+                continue
+            try:
+                call, items = setup(dir, width, height, batch)
+            except Skip, e:
+                results['skipped'][name] = str(e)
+                continue
+            for i in xrange(warmup):
+                call()
+            times = []
+            for i in xrange(repeat):
+                start = timeit.default_timer()
+                call()
+                times.append(timeit.default_timer() - start)
+            results['benchmarks'][name] = stats(times, items)
+    finally:
+        shutil.rmtree(dir)
+    return results
+
+
+def report(results, out):
+    out.write("%-14s %9s %9s %9s %12s\n" %
+              ('benchmark', 'p50 ms', 'p95 ms', 'p99 ms', 'items/s'))
+    for name, setup in benchmarks:
+        if name in results['benchmarks']:
+            s = results['benchmarks'][name]
+            out.write("%-14s %9.3f %9.3f %9.3f %12.1f\n" %
+                      (name, s['p50'], s['p95'], s['p99'], s['throughput']))
+        elif name in results.get('skipped', {}):
+            out.write("%-14s skipped: %s\n" %
+                      (name, results['skipped'][name]))
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
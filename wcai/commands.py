@@ -1,7 +1,10 @@
 import logging
+import sys
 
 from wildcatting.theme import DefaultTheme
 
+from . import bench
+from .corpus import FieldCorpus
 from .data import Simulator, Region, OilProbability, DrillCost
 from .agent import (Agent, Surveying, Report, Drilling, Sales,
                     ProbabilityPrediction, DrillCostPrediction)
@@ -36,6 +39,22 @@ class InitCommand:
             Agent.init(args.agent)
 
 
+class ImportCommand:
+
+    @classmethod
+    def add_subparser(cls, parser):
+        subparser = parser.add_parser(
+            "import", help="import an agent's utility.net files into a "
+            "checkpoint")
+        subparser.add_argument("agent", help="agent name (directory)")
+
+        subparser.set_defaults(run=cls.run)
+
+    @staticmethod
+    def run(args):
+        Agent.import_nets(args.agent)
+
+
 class TrainCommand:
 
     @classmethod
@@ -52,13 +71,16 @@ class TrainCommand:
                                help="show error every n epochs")
         subparser.add_argument("--goal", default=0.1, type=float,
                                help="goal error rate")
+        subparser.add_argument("--batch", type=int,
+                               help="stream the training data from disk in "
+                               "minibatches of n samples")
 
         subparser.set_defaults(run=cls.run)
 
     @staticmethod
     def run(args):
         comp = components[args.component].load(args.agent)
-        comp.train(args.epochs, args.show, args.goal)
+        comp.train(args.epochs, args.show, args.goal, args.batch)
 
 
 class SimulateCommand:
@@ -76,6 +98,10 @@ class SimulateCommand:
                                help="oil field height")
         subparser.add_argument("--visualize", action='store_true',
                                default=False, help="output visualization aid")
+        subparser.add_argument("--corpus", type=str, default=None,
+                               help="read the field from a field corpus")
+        subparser.add_argument("--index", type=int, default=None,
+                               help="corpus field index, random by default")
 
         subparser.set_defaults(run=cls.run)
 
@@ -83,9 +109,16 @@ class SimulateCommand:
     def run(args):
         comp = components[args.component].load(args.agent)
         theme = DefaultTheme()
-        sim = Simulator(theme)
-        field = sim.field(args.width, args.height)
-        site_ct = args.width * args.height
+        if args.corpus:
+            corpus = FieldCorpus(args.corpus)
+            if args.index is None:
+                field = corpus.sample(1)[0]
+            else:
+                field = corpus.field(args.index)
+        else:
+            sim = Simulator(theme)
+            field = sim.field(args.width, args.height)
+        site_ct = field.getWidth() * field.getHeight()
         vfs = [OilProbability(theme, site_ct=site_ct, normalize=True),
                DrillCost(theme, site_ct, True)]
         region = Region.map(field, val_funcs=vfs)
@@ -103,13 +136,36 @@ class LearnCommand:
         subparser = parser.add_parser("learn",
                                       help="learn how to play wildcatting")
         subparser.add_argument("agent", help="agent name (directory)")
+        subparser.add_argument("--games", default=1, type=int,
+                               help="number of games to play")
+        subparser.add_argument("--epsilon", default=0.1, type=float,
+                               help="probability of exploratory decisions")
+        subparser.add_argument("--batch", default=16, type=int,
+                               help="number of games played in lockstep")
+        subparser.add_argument("--workers", default=1, type=int,
+                               help="play games in n actor processes")
+        subparser.add_argument("--sync", default=64, type=int,
+                               help="update components every n games")
+        subparser.add_argument("--components", choices=Agent.rl, nargs='+',
+                               help="only update specified components")
+        subparser.add_argument("--replay", default=0, type=int,
+                               help="update from replay buffers of n "
+                               "decisions per component")
+        subparser.add_argument("--fast", action="store_true", default=False,
+                               help="generate fields with the fast simulator")
+        subparser.add_argument("--corpus", type=str, default=None,
+                               help="play on fields from a field corpus")
+        subparser.add_argument("--checkpoint", default=0, type=int,
+                               help="save the agent every n games")
 
         subparser.set_defaults(run=cls.run)
 
     @staticmethod
     def run(args):
         agent = Agent.load(args.agent)
-        agent.learn()
+        agent.learn(args.games, args.epsilon, args.batch, args.workers,
+                    args.sync, args.components, args.replay, args.fast,
+                    args.corpus, args.checkpoint)
 
 
 class PlayCommand:
@@ -128,3 +184,34 @@ class PlayCommand:
     def run(args):
         agent = Agent.load(args.agent)
         agent.play(args.host, args.game_id)
+
+
+class BenchCommand:
+
+    @classmethod
+    def add_subparser(cls, parser):
+        subparser = parser.add_parser("bench",
+                                      help="time the decision hot paths")
+        subparser.add_argument("--benchmarks", nargs='+',
+                               choices=[b[0] for b in bench.benchmarks],
+                               help="only run specified benchmarks")
+        subparser.add_argument("--width", default=80, type=int,
+                               help="oil field width")
+        subparser.add_argument("--height", default=24, type=int,
+                               help="oil field height")
+        subparser.add_argument("--batch", default=16, type=int,
+                               help="fields or inputs per batched call")
+        subparser.add_argument("--repeat", default=100, type=int,
+                               help="timed calls per benchmark")
+        subparser.add_argument("--file", type=str, default=None,
+                               help="save results to specified JSON file")
+
+        subparser.set_defaults(run=cls.run)
+
+    @staticmethod
+    def run(args):
+        results = bench.run(args.benchmarks, args.width, args.height,
+                            args.batch, args.repeat)
+        bench.report(results, sys.stdout)
+        if args.file:
+            bench.save(results, args.file)
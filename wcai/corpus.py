@@ -0,0 +1,148 @@
+import copy
+import cPickle
+import json
+import os
+
+import numpy as np
+
+from os.path import exists, join
+
+from .data import SiteArrays, LazyOilField
+
+
+class StoredReservoir:
+    """A reservoir read back from a corpus written without its wildcatting
+    reservoirs, answering only for their reserves and size"""
+
+    def __init__(self, size, reserves):
+        self._size = size
+        self._reserves = reserves
+
+    def getReserves(self):
+        return self._reserves
+
+
+class StoredOilField(LazyOilField):
+    """A LazyOilField of a corpus field, whose reservoirs are only read when
+    it is built"""
+
+    def __init__(self, arrays, corpus, k):
+        LazyOilField.__init__(self, arrays, None)
+        self.corpus = corpus
+        self.k = k
+
+    def copies(self):
+        return self.corpus.reservoirs(self.k)
+
+
+class FieldCorpus:
+    """Oil fields generated once and stored for reuse
+
+    The site attributes of the fields are held in (count, height, width) .npy
+    files memory mapped from the corpus directory, so that reading field k is
+    a slice of each, whatever k is, with nothing parsed. Reservoirs are
+    numbered within their field, and their reserves and sizes are held in
+    flat arrays indexed by offsets, the position of each field's first
+    reservoir. Fields are SiteArrays, which only build an OilField when a
+    site is asked for. The wildcatting reservoirs themselves are pickled, and
+    only read once a field is built.
+    """
+
+    sites = {'prob': np.int32, 'cost': np.int32, 'tax': np.int32,
+             'depth': np.int32, 'oil': np.bool_, 'reservoir': np.int32}
+
+    @staticmethod
+    def create(path, sim, count, width=80, height=24, seed=None):
+        """Generate count fields with a Simulator into a corpus at path
+
+        Given a seed, field k is generated from its own seed as by
+        `wcdata field --seed`. The index is written last, so that a corpus
+        is only opened once it is complete.
+        """
+        if not exists(path):
+            os.makedirs(path)
+        arrays = {}
+        for name, dtype in FieldCorpus.sites.items():
+            arrays[name] = np.lib.format.open_memmap(
+                join(path, name + '.npy'), mode='w+', dtype=dtype,
+                shape=(count, height, width))
+
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        reserves, sizes, reservoirs = [], [], []
+        for k in xrange(count):
+            field = sim.field(width, height,
+                              None if seed is None else hash((seed, k)))
+            field = SiteArrays.of(field)
+            for name in FieldCorpus.sites:
+                arrays[name][k] = getattr(field, name)
+            # reservoirs are numbered in order, so their first sites sort
+            # the same way
+            ids, first = np.unique(field.reservoir, return_index=True)
+            first = first[ids >= 0]
+            reserves.append(field.reserves.ravel()[first])
+            sizes.append(field.size.ravel()[first])
+            reservoirs.extend(field.sites[i].getReservoir() for i in first)
+            offsets[k + 1] = offsets[k] + len(first)
+
+        for array in arrays.values():
+            array.flush()
+        np.save(join(path, 'reserves.npy'), np.concatenate(reserves))
+        np.save(join(path, 'sizes.npy'), np.concatenate(sizes))
+        np.save(join(path, 'offsets.npy'), offsets)
+        with open(join(path, 'reservoirs.pkl'), 'wb') as f:
+            cPickle.dump(reservoirs, f, cPickle.HIGHEST_PROTOCOL)
+        with open(join(path, 'corpus.json'), 'w') as f:
+            json.dump({'count': count, 'width': width, 'height': height,
+                       'seed': seed}, f, indent=2, sort_keys=True)
+        return FieldCorpus(path)
+
+    def __init__(self, path):
+        index = join(path, 'corpus.json')
+        if not exists(index):
+            raise ValueError("%s is not a field corpus" % path)
+        with open(index) as f:
+            meta = json.load(f)
+        self.path = path
+        self.width = meta['width']
+        self.height = meta['height']
+        self.arrays = dict((name, np.load(join(path, name + '.npy'),
+                                          mmap_mode='r'))
+                           for name in FieldCorpus.sites)
+        self.reserves, self.sizes, self.offsets = [
+            np.load(join(path, name + '.npy'), mmap_mode='r')
+            for name in ['reserves', 'sizes', 'offsets']]
+        self.stored = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def field(self, k):
+        """Field k as SiteArrays"""
+        i, j = self.offsets[k], self.offsets[k + 1]
+        reserves = np.r_[self.reserves[i:j], 0.0]
+        sizes = np.r_[self.sizes[i:j], 0.0]
+        reservoir = self.arrays['reservoir'][k].astype(int)
+
+        arrays = dict((name, self.arrays[name][k].astype(float))
+                      for name in ['prob', 'cost', 'tax', 'depth', 'oil'])
+        arrays['reservoir'] = reservoir
+        arrays['wet'] = (reservoir >= 0).astype(float)
+        arrays['reserves'] = reserves[reservoir]
+        arrays['size'] = sizes[reservoir]
+        return StoredOilField(arrays, self, k).site_arrays()
+
+    def reservoirs(self, k):
+        """Copies of the reservoirs of field k, for a newly built OilField"""
+        i, j = self.offsets[k], self.offsets[k + 1]
+        path = join(self.path, 'reservoirs.pkl')
+        if not exists(path):
+            return [StoredReservoir(size, bbl) for size, bbl in
+                    zip(self.sizes[i:j], self.reserves[i:j])]
+        if self.stored is None:
+            with open(path, 'rb') as f:
+                self.stored = cPickle.load(f)
+        return [copy.copy(r) for r in self.stored[i:j]]
+
+    def sample(self, count, rnd=np.random):
+        """count fields drawn uniformly with replacement"""
+        return [self.field(k) for k in rnd.randint(len(self), size=count)]
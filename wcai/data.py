@@ -1,152 +1,849 @@
+import copy
 import math
 import random
 import numpy as np
 
+from numpy.lib.stride_tricks import as_strided
 from wildcatting.model import OilField
 from wildcatting.game import (OilFiller, PotentialOilDepthFiller,
                               ReservoirFiller, DrillCostFiller, TaxFiller)
 
+from . import timing
+
 
 rnd = random.Random()
 
 
 def normalize(val, min_val, max_val, min_norm=-1, max_norm=1):
-    return (((val - min_val) / (max_val - min_val)) *
+    return (((val - min_val) / float(max_val - min_val)) *
             (max_norm - min_norm) + min_norm)
 
 
+# Binary training data is a small header giving the input and output widths
+# followed by rows of little endian float32, each holding one sample's inputs
+# followed by its outputs. Files are memory mapped rather than parsed.
+DATA_MAGIC = 'WCAI'
+DATA_VERSION = 1
+DATA_HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'),
+                        ('inputs', '<u4'), ('outputs', '<u4')])
+NPY_MAGIC = '\x93NUMPY'
+
+
+def data_header(inputs, outputs):
+    header = np.array([(DATA_MAGIC, DATA_VERSION, inputs, outputs)],
+                      dtype=DATA_HEADER)
+    return header.tostring()
+
+
+def load_data(path, inputs=None):
+    """Load a training data file as a (samples, inputs + outputs) array
+
+    Binary data and .npy files are memory mapped, anything else is parsed as
+    whitespace delimited text. If inputs is given, binary files whose header
+    declares a different input width are rejected.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(NPY_MAGIC))
+
+    if magic.startswith(DATA_MAGIC):
+        header = np.fromfile(path, dtype=DATA_HEADER, count=1)[0]
+        if header['version'] != DATA_VERSION:
+            raise ValueError("%s: unsupported data version %s" %
+                             (path, header['version']))
+        if inputs is not None and header['inputs'] != inputs:
+            raise ValueError("%s: %s inputs, expected %s" %
+                             (path, header['inputs'], inputs))
+        width = int(header['inputs'] + header['outputs'])
+        return np.memmap(path, dtype='<f4', mode='r',
+                         offset=DATA_HEADER.itemsize).reshape(-1, width)
+    elif magic == NPY_MAGIC:
+        return np.load(path, mmap_mode='r')
+    with timing.timed('io.load'):
+        return np.loadtxt(path, ndmin=2)
+
+
+class TrainingData:
+    """A set of training data files streamed as shuffled minibatches
+
+    Files are split into chunks of rows which are only read when needed,
+    binary and .npy files as slices of their memory maps and text files by
+    seeking to the start of the chunk. Each pass visits the chunks in a
+    random order, shuffling together the rows of mix chunks at a time, so
+    that no more than mix chunks are ever held in memory.
+    """
+
+    def __init__(self, paths, inputs, chunk=4096, mix=8):
+        self.inputs = inputs
+        self.mix = mix
+        self.chunks = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                magic = f.read(len(NPY_MAGIC))
+            if magic.startswith(DATA_MAGIC) or magic == NPY_MAGIC:
+                data = load_data(path, inputs)
+                self.chunks.extend((data, i, min(i + chunk, len(data)),
+                                    min(chunk, len(data) - i))
+                                   for i in xrange(0, len(data), chunk))
+            else:
+                self.chunks.extend(self._text_chunks(path, chunk))
+        self.rows = sum(c[3] for c in self.chunks)
+
+    @staticmethod
+    def _text_chunks(path, chunk):
+        # byte ranges of every chunk's lines
+        start = offset = 0
+        with open(path, 'rb') as f:
+            for i, line in enumerate(f):
+                if i % chunk == 0 and i:
+                    yield (path, start, offset, chunk)
+                    start = offset
+                offset += len(line)
+        if offset > start:
+            yield (path, start, offset, (i % chunk) + 1)
+
+    def __len__(self):
+        return self.rows
+
+    def read(self, chunk):
+        """The rows of a chunk, (source, start, stop, rows), as an array"""
+        data, i, j, rows = chunk
+        timing.count('io.rows', rows)
+        with timing.timed('io.read'):
+            if not isinstance(data, basestring):
+                return data[i:j]
+            with open(data, 'rb') as f:
+                f.seek(i)
+                return np.loadtxt(f.read(j - i).splitlines(), ndmin=2)
+
+    def batches(self, size, rnd=np.random):
+        """Yield one pass over the data as (inputs, outputs) minibatches"""
+        order = rnd.permutation(len(self.chunks))
+        for k in xrange(0, len(order), self.mix):
+            rows = np.concatenate([self.read(self.chunks[c])
+                                   for c in order[k:k + self.mix]])
+            rows = rows[rnd.permutation(len(rows))]
+            for i in xrange(0, len(rows), size):
+                batch = rows[i:i + size]
+                yield batch[:, :self.inputs], batch[:, self.inputs:]
+
+
+def integral(values):
+    """Summed-area table of a (height, width, channels) array
+
+    The table is zero padded so that entry [y, x] holds the sum of every
+    value above and to the left of site (y, x), exclusive.
+    """
+    h, w = values.shape[:2]
+    sat = np.zeros((h + 1, w + 1) + values.shape[2:])
+    np.cumsum(values, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
 class Simulator:
-    def __init__(self, theme):
+    """Generates oil fields with the wildcatting fillers
+
+    A fast simulator instead generates the site attributes of each field as
+    arrays, from a FieldModel fitted to fields from the fillers of the same
+    size. Its fields are SiteArrays, which only build an OilField when a site
+    is asked for. Models already fitted, such as another simulator's, may be
+    given keyed by field size, so that processes need not each fit their own.
+    """
+
+    def __init__(self, theme, fast=False, models=None):
         self.theme = theme
+        self.fast = fast
+        self.models = dict(models or {})
         self.fillers = [OilFiller(self.theme),
                         PotentialOilDepthFiller(self.theme),
                         ReservoirFiller(self.theme),
                         DrillCostFiller(self.theme), TaxFiller(self.theme)]
 
-    def field(self, width, height):
+    def field(self, width, height, seed=None):
+        if self.fast:
+            model = self.model(width, height)
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed & 0xffffffff)
+        if self.fast:
+            with timing.timed('field.generate'):
+                return model.generate(1, width, height)[0]
+
         field = OilField(width, height)
-        map(lambda x: x.fill(field), self.fillers)
+        for filler in self.fillers:
+            with timing.timed('field.' + filler.__class__.__name__):
+                filler.fill(field)
+        return field
+
+    def fields(self, count, width, height):
+        """count fields, generated together by a fast simulator"""
+        if not self.fast:
+            return [self.field(width, height) for i in xrange(count)]
+        model = self.model(width, height)
+        with timing.timed('field.generate'):
+            return model.generate(count, width, height)
+
+    def model(self, width, height):
+        """The FieldModel of fields of the given size, fitted on first use"""
+        if (width, height) not in self.models:
+            # the reference fields are the same whenever they are generated
+            state = random.getstate(), np.random.get_state()
+            ref = Simulator(self.theme)
+            fields = [ref.field(width, height, seed=i)
+                      for i in xrange(FieldModel.references)]
+            random.setstate(state[0])
+            np.random.set_state(state[1])
+            self.models[width, height] = FieldModel.fit(fields)
+        return self.models[width, height]
+
+
+def _phi(x):
+    # standard normal CDF by Abramowitz and Stegun 7.1.26, to within 1.5e-7
+    z = np.abs(x) / math.sqrt(2)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (
+        1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def _smooth(noise, sigma, axis):
+    """Gaussian smoothing of unit white noise along an axis, rescaled to
+    unit variance, with the edges reflected"""
+    if sigma < 0.3:
+        return noise
+    radius = int(3 * sigma)
+    weights = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    weights /= np.sqrt(np.square(weights).sum())
+    n = noise.shape[axis]
+    pad = [(0, 0)] * noise.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(noise, pad, 'reflect')
+    out = np.zeros(noise.shape)
+    for k, w in enumerate(weights):
+        out += w * padded.take(np.arange(k, k + n), axis=axis)
+    return out
+
+
+def _lag_correlation(values, axis):
+    """Correlation of neighbouring sites along an axis of (fields, height,
+    width) values, within each field"""
+    values = values - values.mean(axis=(1, 2), keepdims=True)
+    n = values.shape[axis]
+    a = values.take(np.arange(n - 1), axis=axis)
+    b = values.take(np.arange(1, n), axis=axis)
+    denom = np.sqrt(np.square(a).sum() * np.square(b).sum())
+    return (a * b).sum() / denom if denom else 0.0
+
+
+def _components(mask, right, down):
+    """Label the sites of a (fields, height, width) mask by the connected
+    component they belong to, joined by the given right and down edges"""
+    labels = np.where(mask, np.arange(mask.size).reshape(mask.shape),
+                      mask.size)
+    while True:
+        prev = labels.copy()
+        for edges, axis in [(right, 2), (down, 1)]:
+            a, b = [slice(None)] * 3, [slice(None)] * 3
+            a[axis], b[axis] = slice(None, -1), slice(1, None)
+            a, b = labels[tuple(a)], labels[tuple(b)]
+            least = np.where(edges, np.minimum(a, b), mask.size)
+            np.minimum(a, least, out=a)
+            np.minimum(b, least, out=b)
+        # follow each label to its own label, halving chains every pass
+        flat = labels.reshape(-1)
+        flat[mask.ravel()] = flat[flat[mask.ravel()]]
+        if (labels == prev).all():
+            return labels
+
+
+class LazyOilField:
+    """An OilField of generated site attributes, only built once a site is
+    asked for"""
+
+    def __init__(self, arrays, reservoirs):
+        self.arrays = arrays
+        self.reservoirs = reservoirs
+        self.field = None
+
+    def site_arrays(self):
+        """SiteArrays holding the arrays, standing in for this field"""
+        field = SiteArrays(self)
+        field.__dict__.update(self.arrays)
         return field
 
+    def getWidth(self):
+        return self.arrays['prob'].shape[1]
+
+    def getHeight(self):
+        return self.arrays['prob'].shape[0]
+
+    def getSite(self, row, col):
+        return self.build().getSite(row, col)
+
+    def build(self):
+        if self.field is not None:
+            return self.field
+
+        a = self.arrays
+        reservoirs = self.copies()
+        self.field = OilField(self.getWidth(), self.getHeight())
+        for row in xrange(self.getHeight()):
+            for col in xrange(self.getWidth()):
+                site = self.field.getSite(row, col)
+                site.setProbability(int(a['prob'][row, col]))
+                site.setDrillCost(int(a['cost'][row, col]))
+                site.setTax(int(a['tax'][row, col]))
+                site.setPotentialOilDepth(int(a['depth'][row, col]))
+                site.setOilFlag(bool(a['oil'][row, col]))
+                if a['reservoir'][row, col] >= 0:
+                    site.setReservoir(reservoirs[a['reservoir'][row, col]])
+        return self.field
+
+    def copies(self):
+        """Reservoirs for the sites of a newly built OilField"""
+        return [copy.copy(r) for r in self.reservoirs]
+
+
+class FieldModel:
+    """Statistics of reference fields, from which fields are generated
+
+    Probability, drill cost, tax and depth are each generated as a Gaussian
+    random field, smoothed along each axis to match the correlation of
+    neighbouring reference sites, then mapped onto the pooled distribution
+    of the reference values. Oil is present with the reference rate for the
+    site's probability decile. Neighbouring oil sites are joined into
+    reservoirs at the reference rate, and each reservoir is a copy of a
+    reference reservoir of similar extent.
+    """
+
+    # number of reference fields fitted by Simulator
+    references = 64
+    smooth = ['prob', 'cost', 'tax', 'depth']
+
+    @staticmethod
+    def fit(fields):
+        arrays = [SiteArrays.of(f) for f in fields]
+
+        def stack(name):
+            return np.array([getattr(a, name) for a in arrays])
+
+        model = FieldModel()
+
+        for name in FieldModel.smooth:
+            values = stack(name)
+            model.marginals[name] = np.sort(values.ravel())
+            model.sigmas[name] = [FieldModel.sigma(_lag_correlation(values,
+                                                                    axis))
+                                  for axis in [1, 2]]
+
+        prob, oil, wet = stack('prob'), stack('oil') > 0, stack('wet') > 0
+        bins = model.bins(prob)
+        model.oil_rates = np.array([oil[bins == b].mean() if
+                                    (bins == b).any() else 0.0
+                                    for b in xrange(10)])
+        model.wet_rate = wet[oil].mean() if oil.any() else 0.0
+
+        reservoir = stack('reservoir')
+        for axis in [2, 1]:
+            n = reservoir.shape[axis]
+            a = reservoir.take(np.arange(n - 1), axis=axis)
+            b = reservoir.take(np.arange(1, n), axis=axis)
+            both = (a >= 0) & (b >= 0)
+            model.joins.append((a == b)[both].mean() if both.any() else 0.0)
+
+        for f, res in zip(arrays, reservoir):
+            ids, first, extents = np.unique(res, return_index=True,
+                                            return_counts=True)
+            for i, extent in zip(first[ids >= 0], extents[ids >= 0]):
+                model.reservoirs.append(f.sites[i].getReservoir())
+                model.extents.append(extent)
+        model.reserves = np.array([r.getReserves() for r in model.reservoirs])
+        model.sizes = np.array([r._size for r in model.reservoirs])
+
+        # reference reservoirs grouped by their extent's power of two, with
+        # the nearest group to every power of two
+        bins = np.round(np.log2(model.extents)).astype(int)
+        model.order = np.argsort(bins, kind='mergesort')
+        model.counts = np.bincount(bins, minlength=32)[:32]
+        model.starts = np.cumsum(model.counts) - model.counts
+        groups = np.flatnonzero(model.counts)
+        model.nearest = groups[np.abs(np.arange(32)[:, None] -
+                                      groups).argmin(axis=1)]
+        return model
+
+    @staticmethod
+    def sigma(correlation):
+        """Width of the Gaussian smoothing which correlates neighbours"""
+        # smoothing correlates neighbours by exp(-1 / (4 sigma^2)), and
+        # mapping onto the marginal weakens Gaussian correlation r to about
+        # 6 / pi * asin(r / 2)
+        r = min(2 * math.sin(math.pi * correlation / 6), 0.999)
+        return math.sqrt(-1 / (4 * math.log(r))) if r > 0 else 0.0
+
+    def __init__(self):
+        self.marginals = {}
+        self.sigmas = {}
+        self.joins = []
+        self.reservoirs = []
+        self.extents = []
+
+    def bins(self, prob):
+        lo, hi = self.marginals['prob'][[0, -1]]
+        return np.clip(((prob - lo) * 10 / max(hi - lo, 1)).astype(int), 0, 9)
+
+    def generate(self, count, width, height, rnd=np.random):
+        """Generate count fields as SiteArrays"""
+        shape = (count, height, width)
+        values = {}
+        for name in FieldModel.smooth:
+            noise = rnd.standard_normal(shape)
+            for axis, sigma in zip([1, 2], self.sigmas[name]):
+                noise = _smooth(noise, sigma, axis)
+            marginal = self.marginals[name]
+            i = (_phi(noise) * len(marginal)).astype(int)
+            values[name] = marginal[np.minimum(i, len(marginal) - 1)]
+
+        oil = rnd.rand(*shape) < self.oil_rates[self.bins(values['prob'])]
+        right = (oil[:, :, :-1] & oil[:, :, 1:] &
+                 (rnd.rand(count, height, width - 1) < self.joins[0]))
+        down = (oil[:, :-1] & oil[:, 1:] &
+                (rnd.rand(count, height - 1, width) < self.joins[1]))
+        labels = _components(oil, right, down)
+
+        fields = []
+        for k in xrange(count):
+            ids, reservoir, extents = np.unique(labels[k], return_inverse=True,
+                                                return_counts=True)
+            reservoir = reservoir.reshape(height, width)
+            # the label of sites without oil sorts last
+            n = len(ids) - (ids[-1] == labels.size)
+            wet = np.r_[rnd.rand(n) < self.wet_rate, False]
+            chosen = self.choose(extents[:n], rnd)[wet[:n]]
+            remap = np.cumsum(wet) - 1
+            remap[~wet] = -1
+            reservoir = remap[reservoir]
+
+            arrays = dict((name, values[name][k]) for name in values)
+            arrays['oil'] = oil[k].astype(float)
+            arrays['reservoir'] = reservoir
+            arrays['wet'] = (reservoir >= 0).astype(float)
+            arrays['reserves'] = np.r_[self.reserves[chosen], 0.0][reservoir]
+            arrays['size'] = np.r_[self.sizes[chosen], 0.0][reservoir]
+            reservoirs = [self.reservoirs[c] for c in chosen]
+            fields.append(LazyOilField(arrays, reservoirs).site_arrays())
+        return fields
+
+    def choose(self, extents, rnd):
+        """Indices of reference reservoirs of about the given extents"""
+        bins = np.round(np.log2(extents)).astype(int)
+        bins = self.nearest[np.minimum(bins, 31)]
+        i = (rnd.rand(len(bins)) * self.counts[bins]).astype(int)
+        return self.order[self.starts[bins] + i]
+
+
+def _reservoir(attr):
+    def get(site):
+        reservoir = site.getReservoir()
+        return attr(reservoir) if reservoir else 0
+    return get
+
+
+class SiteArrays:
+    """Site attributes of a rectangle of an OilField as (height, width) arrays
+
+    Each attribute is pulled out of the field's sites the first time it is
+    read and kept for subsequent value functions, so a SiteArrays must not
+    outlive changes to its sites, or must be invalidated after them. It
+    stands in for the field itself: views of sub-rectangles, and so Regions
+    mapped or zoomed from it, slice its attributes rather than reading the
+    sites again. Besides the getters' attributes, reservoir numbers the
+    field's reservoirs, with -1 for sites without one.
+    """
+    getters = {'prob': lambda site: site.getProbability(),
+               'cost': lambda site: site.getDrillCost(),
+               'tax': lambda site: site.getTax(),
+               'depth': lambda site: site.getPotentialOilDepth(),
+               'oil': lambda site: site.getOilFlag(),
+               'wet': lambda site: site.getReservoir() is not None,
+               'reserves': _reservoir(lambda r: r.getReserves()),
+               'size': _reservoir(lambda r: r._size)}
+
+    @staticmethod
+    def of(field, pos=(0, 0), size=None):
+        if isinstance(field, SiteArrays):
+            return field.view(pos, size)
+        return SiteArrays(field, pos, size)
+
+    def __init__(self, field, pos=(0, 0), size=None, parent=None):
+        if not size:
+            size = (field.getWidth(), field.getHeight())
+
+        self.field = field
+        self.pos = pos
+        self.wh = size
+        self.parent = parent
+        self.pyramids = {}
+
+    def view(self, pos=(0, 0), size=None):
+        if not size:
+            size = self.wh
+        if tuple(pos) == (0, 0) and tuple(size) == tuple(self.wh):
+            return self
+        pos = (self.pos[0] + pos[0], self.pos[1] + pos[1])
+        return SiteArrays(self.field, pos, size, self.parent or self)
+
+    def getWidth(self):
+        return self.wh[0]
+
+    def getHeight(self):
+        return self.wh[1]
+
+    def getSite(self, row, col):
+        return self.field.getSite(self.pos[1] + row, self.pos[0] + col)
+
+    def pyramid(self, val_funcs):
+        """The Pyramid of val_funcs over this field, built on first use"""
+        key = tuple(val_funcs)
+        if key not in self.pyramids:
+            self.pyramids[key] = Pyramid(self, val_funcs)
+        return self.pyramids[key]
+
+    def invalidate(self):
+        """Forget everything read from the sites, after they have changed"""
+        for name in SiteArrays.getters.keys() + ['reservoir', 'sites']:
+            self.__dict__.pop(name, None)
+        self.pyramids.clear()
+
+    def __getattr__(self, name):
+        x, y = self.pos
+        w, h = self.wh
+        if name == 'sites':
+            vals = [self.field.getSite(row, col)
+                    for row in xrange(y, y + h)
+                    for col in xrange(x, x + w)]
+        elif name == 'reservoir' and self.parent is None:
+            # reservoirs numbered in order of appearance, -1 for none
+            ids = {}
+            vals = np.array([-1 if s.getReservoir() is None else
+                             ids.setdefault(id(s.getReservoir()), len(ids))
+                             for s in self.sites]).reshape(h, w)
+        elif ((name in SiteArrays.getters or name == 'reservoir') and
+              self.parent is not None):
+            x -= self.parent.pos[0]
+            y -= self.parent.pos[1]
+            vals = getattr(self.parent, name)[y:y + h, x:x + w]
+        elif name in SiteArrays.getters:
+            get = SiteArrays.getters[name]
+            sites = self.sites
+            with timing.timed('extract.' + name):
+                vals = np.array([get(site) for site in sites], dtype=float)
+            vals = vals.reshape(h, w)
+        else:
+            raise AttributeError(name)
+        setattr(self, name, vals)
+        return vals
+
+
+class Mapping:
+    """Value functions over a rectangle of a field, evaluated lazily
+
+    The values are held as a (height, width, channels) array, of which each
+    channel is only evaluated the first time it is asked for. Lazy Regions
+    are views of a mapping.
+    """
+
+    def __init__(self, field, val_funcs, pos=(0, 0), size=None, scale=1):
+        if not size:
+            size = (field.getWidth(), field.getHeight())
+
+        self.field = field
+        # channels evaluated separately share the sites read from the field
+        self.arrays = SiteArrays.of(field, pos, size)
+        self.val_funcs = list(val_funcs)
+        self.keys = [vf.key for vf in val_funcs]
+        self.pos = pos
+        self.size = size
+        self.scale = scale
+        self.values = np.empty((size[1], size[0], len(self.val_funcs)))
+        self.evaluated = set()
+
+    def array(self, keys):
+        """The values array, with at least the channels of keys evaluated"""
+        missing = [c for c, key in enumerate(self.keys)
+                   if key in keys and key not in self.evaluated]
+        if missing:
+            self.values[:, :, missing] = Region.evaluate(
+                self.arrays, [self.val_funcs[c] for c in missing],
+                scale=self.scale)
+            self.evaluated.update(self.keys[c] for c in missing)
+        return self.values
+
 
 class Region:
+    """A rectangle of site values held as a (height, width, channels) array
+
+    Each value function mapped onto the region occupies one channel of the
+    values array. The channels dict maps value function keys to their channel
+    index.
+
+    A region may be a lazy view of a Mapping, covering every step'th site
+    across and down from an offset into it. Nothing is evaluated until its
+    values or inputs are asked for, when they are sliced out of the mapping
+    without a copy, and inputs only evaluate the channels they include.
+    """
+
     @staticmethod
     def map(field, val_funcs=[], pos=(0, 0), size=None):
         if not size:
             size = (field.getWidth(), field.getHeight())
 
-        region = Region()
-        region.field = field
-        region.size = size   # size of corresponding region in field
-        region.scale = 1
-        region.pos = pos
-        region.wh = size  # width, height of the region
-
-        x, y = pos
-        for row in xrange(y, y + size[1]):
-            for col in xrange(x, x + size[0]):
-                site = field.getSite(row, col)
-                vals = {}
-                for vf in val_funcs:
-                    vals[vf.key] = vf.value(site)
-                region.sites.append(vals)
-        return region
+        mapping = Mapping(field, val_funcs, pos, size)
+        return Region(field, mapping.keys, pos=pos, size=size,
+                      source=mapping, wh=size)
+
+    @staticmethod
+    def evaluate(field, val_funcs, pos=(0, 0), size=None, scale=1):
+        """Evaluate val_funcs over a rectangle of field into a new array"""
+        if not size:
+            size = (field.getWidth(), field.getHeight())
+
+        w, h = size
+        arrays = SiteArrays.of(field, pos, size)
+        values = np.empty((h, w, len(val_funcs)))
+        for c, vf in enumerate(val_funcs):
+            if hasattr(vf, 'values'):
+                values[:, :, c] = vf.values(arrays, scale)
+                continue
+            for i, site in enumerate(arrays.sites):
+                values[i / w, i % w, c] = vf.value(site, scale)
+        return values
 
     @staticmethod
     def partition(field, scale, val_funcs):
         w = field.getWidth() / scale  # 10
         h = field.getHeight() / scale  # 3
+        mapping = Mapping(field, val_funcs, scale=scale)
         parts = []
         for i in xrange(w * h):
-            part = Region()
-            part.field = field
-            part.size = (w, h)  # (10, 3)
-            part.scale = 1
             (x, y) = (i % w, i / w)
-            part.pos = (x, y)
-            part.wh = (w, h)
-            for row in xrange(y, y + h):
-                for col in xrange(x, x + w):
-                    site = field.getSite(row, col)
-                    vals = {}
-                    for vf in val_funcs:
-                        vals[vf.key] = vf.value(site, scale)
-                    part.sites.append(vals)
+            part = Region(field, mapping.keys, pos=(x, y), size=(w, h),
+                          source=mapping, offset=(x, y), wh=(w, h))
             parts.append(part)
         return parts
 
     @staticmethod
     def reduce(region, scale):
-        reduct = Region()
-        reduct.field = region.field
-        reduct.size = region.wh
-        reduct.scale = scale
-        reduct.pos = region.pos
-        reduct.wh = np.array(region.size) / scale
+        y0, y1, x0, x1, area = Region.bounds(region, scale)
 
-        # define the dimensions of the rectangle in the field
-        fwh = 2.0 * np.array(region.wh) / (np.array(reduct.wh) + 1.0)
-        # offsets between overlapped subregions
-        ox, oy = fwh / 2.0
-        # iterate across the overlapping regions
-        fy = -oy
-        for y in xrange(reduct.wh[1]):
-            fy += oy
-            fx = -ox
-            for x in xrange(reduct.wh[0]):
-                fx += ox
-                avgs = Region.avgs(fx, fy, fwh, region)
-                reduct.sites.append(avgs)
+        # sum every subregion at once from the summed-area table
+        with timing.timed('reduce'):
+            sat = integral(region.values)
+            sums = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+        reduct = Region(region.field, region.keys, sums / area,
+                        pos=region.pos, size=region.wh, scale=scale)
         return reduct
 
+    # window bounds by reduced and original size, shared by every reduction
+    _geometry = {}
+
     @staticmethod
-    def avgs(x, y, size, region):
-        avgs = {}
-        for val in region.sites[0].keys():
-            avgs[val] = 0
+    def bounds(region, scale):
+        """The geometry of reducing region by scale, computed once per size"""
+        wh = tuple(np.array(region.size) / scale)
+        key = (wh, tuple(region.wh))
+        if key not in Region._geometry:
+            Region._geometry[key] = Region.geometry(wh, region.wh)
+        return Region._geometry[key]
 
-        w, h = size
-        x_range = int(math.ceil(x + w) - math.floor(x))
-        y_range = int(math.ceil(y + h) - math.floor(y))
-        for row in xrange(y_range):
-            for col in xrange(x_range):
-                site = region.site(int(math.floor(y)) + row,
-                                   int(math.floor(x)) + col)
-                for val in site.keys():
-                    avgs[val] += site[val]
-
-        area = x_range * y_range
-        for val in avgs.keys():
-            avgs[val] /= area
-        return avgs
+    @staticmethod
+    def geometry(wh, size):
+        """Bounds and areas of the overlapping subregions reducing a region of
+        the given size to wh, broadcastable against each other"""
+        # define the dimensions of the rectangle in the field
+        fwh = 2.0 * np.array(size) / (np.array(wh) + 1.0)
+        # the overlapping subregions along each axis, clipped to the region
+        x0, x1 = Region.windows(wh[0], fwh[0], size[0])
+        y0, y1 = Region.windows(wh[1], fwh[1], size[1])
+        area = np.outer(y1 - y0, x1 - x0)[:, :, np.newaxis]
+        return y0[:, np.newaxis], y1[:, np.newaxis], x0, x1, area
 
-    def __init__(self):
-        self.sites = []
+    @staticmethod
+    def windows(ct, length, limit):
+        """Bounds of ct windows of the given length, each offset by half"""
+        # accumulate offsets in order so that bounds land exactly as they
+        # would stepping across the region one window at a time
+        offsets = np.cumsum(np.r_[0.0, np.repeat(length / 2.0, ct - 1)])
+        lo = np.floor(offsets).astype(int)
+        hi = np.ceil(offsets + length).astype(int)
+        return lo, np.minimum(hi, limit)
+
+    @staticmethod
+    def avgs(x, y, size, region):
+        w, h = size
+        x0, y0 = int(math.floor(x)), int(math.floor(y))
+        x1, y1 = int(math.ceil(x + w)), int(math.ceil(y + h))
+        avgs = region.values[y0:y1, x0:x1].mean(axis=(0, 1))
+        return dict(zip(region.keys, avgs))
+
+    def __init__(self, field=None, keys=[], values=None, pos=(0, 0),
+                 size=None, scale=1, source=None, offset=(0, 0), wh=None,
+                 step=(1, 1)):
+        self.field = field
+        self.keys = list(keys)
+        self.channels = dict((k, c) for c, k in enumerate(self.keys))
+        if values is None and source is None:
+            values = np.empty((0, 0, len(self.keys)))
+        self._values = values
+        # the Mapping of a lazy view, with the view's offset into it and
+        # step between sites
+        self.source = source
+        self.offset = offset
+        self.step = step
+        self.pos = pos
+        if values is not None:
+            wh = (values.shape[1], values.shape[0])
+        self.wh = tuple(wh)  # width, height
+        self.size = size or self.wh  # size of corresponding region in field
+        self.scale = scale
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self.window(self.source.array(self.keys))
+        return self._values
+
+    def window(self, array):
+        """The view's sites of an array the shape of its mapping"""
+        (x, y), (sx, sy), (w, h) = self.offset, self.step, self.wh
+        return array[y:y + (h - 1) * sy + 1:sy, x:x + (w - 1) * sx + 1:sx]
+
+    # how slide treats windows overhanging the far edges: dropping them, or
+    # padding the region with its edge values or by wrapping around
+    boundaries = ['drop', 'edge', 'wrap']
+
+    def slide(self, wh, stride, boundary='drop'):
+        """Windows of wh sites stepping by stride across and down the region
+
+        Returns a (rows, cols, height, width, channels) strided view of the
+        values, so that no window is copied until it is read. Unless
+        overhanging windows are dropped, the values are first padded just
+        enough for the last windows to reach the far edges.
+        """
+        (w, h), (sx, sy) = wh, stride
+        values = self.values
+        if boundary != 'drop':
+            rows, cols = values.shape[:2]
+            pad_y = -(-max(rows - h, 0) // sy) * sy + h - rows
+            pad_x = -(-max(cols - w, 0) // sx) * sx + w - cols
+            values = np.pad(values, ((0, pad_y), (0, pad_x), (0, 0)),
+                            boundary)
+        rows, cols, channels = values.shape
+        shape = (max((rows - h) // sy + 1, 0), max((cols - w) // sx + 1, 0),
+                 h, w, channels)
+        s0, s1, s2 = values.strides
+        return as_strided(values, shape, (s0 * sy, s1 * sx, s0, s1, s2))
+
+    def crops(self, wh, count, boundary='drop', rnd=np.random):
+        """count (height, width, channels) windows of wh sites at random
+        positions, copied out of a strided view"""
+        windows = self.slide(wh, (1, 1), boundary)
+        rows = rnd.randint(windows.shape[0], size=count)
+        cols = rnd.randint(windows.shape[1], size=count)
+        return windows[rows, cols]
+
+    def view(self, offset, wh, step=(1, 1)):
+        """A lazy view of part of this region, stepping over its sites"""
+        if self.source is None:
+            raise ValueError("only views of a Mapping can be viewed lazily")
+        (x, y), (sx, sy) = self.offset, self.step
+        x, y = x + offset[0] * sx, y + offset[1] * sy
+        sx, sy = sx * step[0], sy * step[1]
+        pos = (self.source.pos[0] + x, self.source.pos[1] + y)
+        size = ((wh[0] - 1) * sx + 1, (wh[1] - 1) * sy + 1)
+        return Region(self.field, self.keys, pos=pos, size=size,
+                      scale=self.scale, source=self.source, offset=(x, y),
+                      wh=wh, step=(sx, sy))
 
     def __str__(self):
         str_ = ""
-        for i, s in enumerate(self.sites):
-            str_ += ("%s " % (int(s['prob'] * 10)))
-            if (i + 1) % self.wh[0] == 0:
-                str_ += "\n"
-        str_ += "(Covering %s %s)" % self.size
+        for row in self.channel('prob'):
+            for prob in row:
+                str_ += ("%s " % (int(prob * 10)))
+            str_ += "\n"
+        str_ += "(Covering %s %s)" % tuple(self.size)
         return str_
 
+    @property
+    def sites(self):
+        """Per-site {key: value} dicts in row major order"""
+        return [dict(zip(self.keys, vals))
+                for vals in self.values.reshape(-1, len(self.keys))]
+
+    def channel(self, key):
+        if self._values is None:
+            return self.window(self.source.array([key]))[
+                :, :, self.channels[key]]
+        return self.values[:, :, self.channels[key]]
+
     def coords(self, idx):
         return np.array([idx % self.wh[0], idx / self.wh[0]])
 
     def inputs(self, vals):
-        inputs = []
-        for s in self.sites:
-            for val in vals:
-                inputs.append(s[val])
-        return inputs
+        idx = [self.channels[val] for val in vals]
+        if idx == range(len(self.keys)):
+            return self.values.reshape(-1)
+        values = self._values
+        if values is None:
+            values = self.window(self.source.array(vals))
+        return values[:, :, idx].reshape(-1)
 
     def site(self, row, col):
-        site = self.sites[row * self.wh[0] + col]
-        return site
-
-
+        return dict(zip(self.keys, self.values[row, col]))
+
+
+class Pyramid:
+    """Value functions mapped over a whole field at once for zooming in
+
+    The mapping is kept along with its summed-area table, so that a region
+    of the field at any zoom level is a slice of the mapping and a reduction
+    of one is a lookup in the table. Reductions are memoized, so that the
+    levels of consecutive decisions on the same field are only reduced once.
+    """
+
+    def __init__(self, field, val_funcs):
+        self.field = field
+        self.full = Region.map(field, val_funcs)
+        self.sat = integral(self.full.values)
+        self.reducts = {}
+
+    def region(self, pos, size):
+        """The mapped region of the given position and size, as a view"""
+        (x, y), (w, h) = pos, size
+        return Region(self.field, self.full.keys,
+                      self.full.values[y:y + h, x:x + w], pos=pos, size=size)
+
+    def reduce(self, region, scale):
+        """Region.reduce of one of the pyramid's regions"""
+        key = (tuple(region.pos), tuple(region.wh), scale)
+        if key not in self.reducts:
+            y0, y1, x0, x1, area = Region.bounds(region, scale)
+            x, y = region.pos
+            y0, y1, x0, x1 = y0 + y, y1 + y, x0 + x, x1 + x
+            sat = self.sat
+            with timing.timed('reduce'):
+                sums = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+            self.reducts[key] = Region(self.field, region.keys, sums / area,
+                                       pos=region.pos, size=region.wh,
+                                       scale=scale)
+        return self.reducts[key]
+
+
+# Value functions map a site to a single value with value(site, scale). They
+# may also provide values(field, scale), evaluating every site of an OilField
+# or SiteArrays at once as a (height, width) array, which Region uses whenever
+# it is available.
 class ValueFunction:
     def __init__(self, theme, site_ct, normalize=False):
         self.theme = theme
@@ -163,6 +860,12 @@ class OilProbability(ValueFunction):
             prob = normalize(prob, 0.0, 100.0)
         return prob
 
+    def values(self, field, scale=1):
+        prob = SiteArrays.of(field).prob
+        if self.normalize:
+            prob = normalize(prob, 0.0, 100.0)
+        return prob
+
 
 class DrillCost(ValueFunction):
     key = "cost"
@@ -174,6 +877,13 @@ class DrillCost(ValueFunction):
                              self.theme.getMaxDrillCost())
         return cost
 
+    def values(self, field, scale=1):
+        cost = SiteArrays.of(field).cost
+        if self.normalize:
+            cost = normalize(cost, self.theme.getMinDrillCost(),
+                             self.theme.getMaxDrillCost())
+        return cost
+
 
 class Taxes(ValueFunction):
     key = "tax"
@@ -183,6 +893,14 @@ class Taxes(ValueFunction):
         if self.normalize:
             tax = normalize(tax, self.theme.getMinTax(),
                             self.theme.getMaxTax())
+        return tax
+
+    def values(self, field, scale=1):
+        tax = SiteArrays.of(field).tax
+        if self.normalize:
+            tax = normalize(tax, self.theme.getMinTax(),
+                            self.theme.getMaxTax())
+        return tax
 
 
 # TODO normalization
@@ -197,6 +915,10 @@ class OilValue(ValueFunction):
             reserves = reservoir.getReserves()
         return price * reserves
 
+    def values(self, field, scale=1):
+        price = self.theme.getOilPrices()._price
+        return price * SiteArrays.of(field).reserves
+
 
 # TODO normalization
 class OilReserves(ValueFunction):
@@ -209,6 +931,9 @@ class OilReserves(ValueFunction):
             reserves = reservoir.getReserves()
         return reserves
 
+    def values(self, field, scale=1):
+        return SiteArrays.of(field).reserves
+
 
 class OilPresence(ValueFunction):
     key = "wet"
@@ -216,6 +941,9 @@ class OilPresence(ValueFunction):
     def value(self, site, scale=1):
         return 0.0 if site.getReservoir() is None else 1.0
 
+    def values(self, field, scale=1):
+        return SiteArrays.of(field).wet
+
 
 class ReservoirSize(ValueFunction):
     key = "size"
@@ -229,6 +957,15 @@ class ReservoirSize(ValueFunction):
                 size = normalize(size, 0, self.site_ct / (scale ** 2))
         return size
 
+    def values(self, field, scale=1):
+        arrays = SiteArrays.of(field)
+        size = arrays.size
+        if self.normalize:
+            size = np.where(arrays.wet,
+                            normalize(size, 0, self.site_ct / (scale ** 2)),
+                            0.0)
+        return size
+
 
 ## estimate the utility of surveying in the specified site. in wilcatting, the
 ## utility is the expected future monetary gain. this is a heuristic function
@@ -265,3 +1002,12 @@ class UtilityEstimator(ValueFunction):
         utility = np.tanh((expected - expense) / max_oil)
 
         return utility
+
+    def values(self, field, scale=1):
+        arrays = SiteArrays.of(field)
+        price = self.theme.getOilPrices()._price
+        expense = np.where(arrays.oil, arrays.cost * arrays.depth * 10.0,
+                           arrays.cost * 100.0)
+        expected = arrays.reserves * price
+        max_oil = 5 * self.theme.getMeanSiteReserves() * price
+        return np.tanh((expected - expense) / max_oil)
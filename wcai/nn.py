@@ -0,0 +1,277 @@
+import json
+import os
+import tempfile
+
+import neurolab as nl
+import numpy as np
+
+from os.path import dirname
+
+from . import timing
+
+
+class MLP:
+    """Batched evaluation of a feed forward neurolab network
+
+    The layer weights are read out of the network once and a whole batch of
+    input vectors is then pushed through each layer with a single matrix
+    multiply, applying the layer's own transfer function. The weight arrays
+    are shared with the network rather than copied.
+    """
+
+    def __init__(self, net):
+        # neurolab chains a feed forward net as [[-1], [0], [1], ...]
+        if net.connect != [[i - 1] for i in xrange(len(net.layers) + 1)]:
+            raise ValueError("only feed forward networks are supported")
+
+        self.ci = net.ci
+        self.co = net.co
+        self.layers = []
+        for layer in net.layers:
+            if sorted(layer.np.keys()) != ['b', 'w']:
+                raise ValueError("unsupported layer %s" %
+                                 type(layer).__name__)
+            self.layers.append((layer.np['w'].T, layer.np['b'],
+                                layer.transf))
+
+    def check(self, inputs):
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.ndim != 2 or inputs.shape[1] != self.ci:
+            raise ValueError("expected inputs of shape (n, %s), got %s" %
+                             (self.ci, inputs.shape))
+        return inputs
+
+    def sim(self, inputs):
+        """Evaluate a (batch, ci) array of inputs into a (batch, co) array"""
+        out = self.check(inputs)
+        timing.count('nn.rows', len(out))
+        with timing.timed('nn.sim'):
+            for w, b, transf in self.layers:
+                out = transf(np.dot(out, w) + b)
+        return out
+
+
+class WeightStore:
+    """Network weights shared between processes through a memory map
+
+    A learner publishes flattened weight arrays with an increasing version,
+    and other processes attach to the store and view the arrays of the
+    latest version in place, with nothing copied or unpickled. Each version
+    is written to the next of a ring of slots, so a reader is never handed a
+    slot in the middle of being written, and the arrays it holds stay intact
+    until slots - 1 further versions have been published, when their slot
+    may start to be written again. Readers holding on to a version check
+    that it is still intact before trusting what they computed with it.
+    """
+
+    header = np.dtype([('magic', 'S4'), ('slots', '<u4'), ('size', '<u8'),
+                       ('version', '<u8')])
+    magic = 'WCWS'
+    offset = 64  # keep the weights aligned
+
+    @staticmethod
+    def create(shapes, slots=3):
+        """Create a store for arrays of the given shapes in a temporary file"""
+        fd, path = tempfile.mkstemp(prefix='wcai-weights-')
+        os.close(fd)
+        size = sum(int(np.prod(s)) for s in shapes)
+        header = np.zeros(1, dtype=WeightStore.header)
+        header[0] = (WeightStore.magic, slots, size, 0)
+        with open(path, 'wb') as f:
+            f.write(header.tostring().ljust(WeightStore.offset, '\0'))
+            f.truncate(WeightStore.offset + slots * size * 8)
+        return WeightStore(path, shapes, writable=True)
+
+    def __init__(self, path, shapes, writable=False):
+        self.path = path
+        self.shapes = [tuple(s) for s in shapes]
+        mode = 'r+' if writable else 'r'
+        self.mm = np.memmap(path, dtype=np.uint8, mode=mode)
+        self.meta = self.mm[:WeightStore.header.itemsize].view(
+            WeightStore.header)
+        if self.meta['magic'][0] != WeightStore.magic:
+            raise ValueError("%s is not a weight store" % path)
+        slots, size = int(self.meta['slots'][0]), int(self.meta['size'][0])
+        self.data = self.mm[WeightStore.offset:].view('<f8')
+        self.data = self.data.reshape(slots, size)
+
+    @property
+    def version(self):
+        return int(self.meta['version'][0])
+
+    def publish(self, weights):
+        """Write a new version of the weights, returning its number"""
+        version = self.version + 1
+        slot = self.data[version % len(self.data)]
+        i = 0
+        for w in weights:
+            slot[i:i + w.size] = w.ravel()
+            i += w.size
+        self.meta['version'] = version
+        return version
+
+    def intact(self, version):
+        """Whether the slot of a version cannot have been written since"""
+        return self.version - version < len(self.data) - 1
+
+    def arrays(self, version=None):
+        """Views of the arrays of a version, by default the latest"""
+        if version is None:
+            version = self.version
+        slot = self.data[version % len(self.data)]
+        arrays = []
+        i = 0
+        for shape in self.shapes:
+            size = int(np.prod(shape))
+            arrays.append(slot[i:i + size].reshape(shape))
+            i += size
+        return arrays
+
+    def close(self, unlink=False):
+        self.mm._mmap.close()
+        if unlink:
+            os.remove(self.path)
+
+
+class SGD:
+    """Minibatch gradient descent with momentum on a feed forward network
+
+    Each step backpropagates the mean squared error of a minibatch through
+    the network and updates its weight arrays in place, so that MLPs sharing
+    them see the change immediately. If clip is set, the gradient is scaled
+    down to at most that norm before each step.
+    """
+
+    def __init__(self, net):
+        self.mlp = MLP(net)
+        self.params = [l.np[p] for l in net.layers for p in ['w', 'b']]
+        self.velocity = [np.zeros_like(p) for p in self.params]
+
+    def gradients(self, inputs, targets):
+        """Gradients of the weight arrays for a minibatch, and the loss"""
+        outs = [self.mlp.check(inputs)]
+        nets = []
+        for w, b, transf in self.mlp.layers:
+            nets.append(np.dot(outs[-1], w) + b)
+            outs.append(transf(nets[-1]))
+
+        err = outs[-1] - targets
+        loss = np.square(err).sum(axis=1).mean()
+        grads = []
+        delta = err * (2.0 / len(err))
+        for i in reversed(xrange(len(self.mlp.layers))):
+            w, b, transf = self.mlp.layers[i]
+            delta = delta * transf.deriv(nets[i], outs[i + 1])
+            # weights are held (co, ci) by neurolab
+            grads[:0] = [np.dot(delta.T, outs[i]), delta.sum(axis=0)]
+            delta = np.dot(delta, w.T)
+        return grads, loss
+
+    def step(self, inputs, targets, lr=0.01, momentum=0.9, clip=None):
+        """Take one step on a minibatch, returning its loss before the step"""
+        with timing.timed('nn.gradients'):
+            grads, loss = self.gradients(inputs,
+                                         np.asarray(targets, dtype=float))
+        if clip is not None:
+            norm = np.sqrt(sum(np.square(g).sum() for g in grads))
+            if norm > clip:
+                grads = [g * (clip / norm) for g in grads]
+        for p, v, g in zip(self.params, self.velocity, grads):
+            v *= momentum
+            v -= lr * g
+            p += v
+        return loss
+
+
+class Checkpoint:
+    """Feed forward networks saved together in one file with their metadata
+
+    The file holds a header and the metadata as JSON, including the layout
+    of each network, followed by the weight arrays of every network. It is
+    written to a temporary file beside the checkpoint which is then renamed
+    over it, so that a reader only ever finds a whole checkpoint. Loading
+    memory maps the weights copy on write, so that networks are rebuilt
+    around views of the file with nothing unpickled, and may then be trained
+    in place without changing the file.
+    """
+
+    header = np.dtype([('magic', 'S4'), ('version', '<u4'), ('meta', '<u8')])
+    magic = 'WCCK'
+    version = 1
+    offset = 64  # the metadata, followed by the weights aligned
+
+    @staticmethod
+    def start(meta):
+        """Offset of the weights after metadata of the given length"""
+        return -(-(Checkpoint.offset + meta) // 64) * 64
+
+    @staticmethod
+    def save(path, nets, meta={}):
+        """Atomically write a dict of named networks and a metadata dict"""
+        layouts = {}
+        arrays = []
+        size = 0
+        for name in sorted(nets):
+            net = nets[name]
+            MLP(net)  # only feed forward networks are supported
+            layouts[name] = {
+                'minmax': np.asarray(net.inp_minmax).tolist(),
+                'sizes': [l.co for l in net.layers],
+                'transfs': [l.transf.__class__.__name__ for l in net.layers],
+                'start': size}
+            for l in net.layers:
+                for p in ['w', 'b']:
+                    arrays.append(l.np[p])
+                    size += l.np[p].size
+
+        text = json.dumps(dict(meta, nets=layouts), sort_keys=True)
+        header = np.zeros(1, dtype=Checkpoint.header)
+        header[0] = (Checkpoint.magic, Checkpoint.version, len(text))
+        fd, tmp = tempfile.mkstemp(prefix='.checkpoint-',
+                                   dir=dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.tostring().ljust(Checkpoint.offset, '\0'))
+                f.write(text.ljust(Checkpoint.start(len(text)) -
+                                   Checkpoint.offset, '\0'))
+                for a in arrays:
+                    f.write(np.asarray(a, dtype='<f8').tostring())
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp makes files only their owner may read
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0666 & ~umask)
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+    @staticmethod
+    def load(path):
+        """The dict of named networks and the metadata dict of a checkpoint"""
+        mm = np.memmap(path, dtype=np.uint8, mode='c')
+        header = mm[:Checkpoint.header.itemsize].view(Checkpoint.header)[0]
+        if header['magic'] != Checkpoint.magic:
+            raise ValueError("%s is not a checkpoint" % path)
+        if header['version'] > Checkpoint.version:
+            raise ValueError("%s is a checkpoint of version %s" %
+                             (path, header['version']))
+        length = int(header['meta'])
+        meta = json.loads(mm[Checkpoint.offset:
+                             Checkpoint.offset + length].tostring())
+        data = mm[Checkpoint.start(length):].view('<f8')
+
+        nets = {}
+        for name, layout in meta.pop('nets').items():
+            transfs = [getattr(nl.trans, t)() for t in layout['transfs']]
+            net = nl.net.newff(layout['minmax'], layout['sizes'], transfs)
+            i = layout['start']
+            for l in net.layers:
+                for p in ['w', 'b']:
+                    shape = l.np[p].shape
+                    size = int(np.prod(shape))
+                    l.np[p] = data[i:i + size].reshape(shape)
+                    i += size
+            nets[name] = net
+        return nets, meta
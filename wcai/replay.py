@@ -0,0 +1,172 @@
+import logging
+import os
+
+import numpy as np
+
+from os.path import exists, join
+
+log = logging.getLogger("wcai")
+
+
+class ReplayBuffer:
+    """Fixed capacity ring of a component's transitions
+
+    Each transition keeps the component's inputs, the action taken, the
+    reward received, the inputs it was next applied to and whether there were
+    none, along with a sampling priority. Fields are held in preallocated
+    arrays, so that adding a transition overwrites the oldest once the buffer
+    is full. If a path is given, the arrays are .npy files memory mapped from
+    that directory, so that the buffer may outgrow memory and is picked up
+    again by the next buffer opened there. A buffer opened there with another
+    capacity keeps as many of the most recent transitions as it can hold.
+    """
+
+    # fields holding one entry per transition
+    transitions = ['inputs', 'actions', 'rewards', 'next_inputs', 'done',
+                   'priorities']
+
+    def __init__(self, inputs, capacity, path=None):
+        self.fields = {'inputs': (np.float64, (capacity, inputs)),
+                       'next_inputs': (np.float64, (capacity, inputs)),
+                       'actions': (np.int64, (capacity,)),
+                       'rewards': (np.float64, (capacity,)),
+                       'done': (np.bool_, (capacity,)),
+                       'priorities': (np.float64, (capacity,)),
+                       # the highest priority given so far
+                       'max_priority': (np.float64, (1,)),
+                       # number of transitions held, and the next to replace
+                       'state': (np.int64, (2,))}
+        self.path = path
+        if path is not None and not exists(path):
+            os.makedirs(path)
+        kept = self._resize(inputs, capacity)
+        for name, (dtype, shape) in self.fields.items():
+            setattr(self, name, self._array(name, dtype, shape))
+        if kept and len(kept[0]):
+            self.add(*kept)
+        if len(self) and not self.max_priority[0]:
+            # picked up from a buffer saved without one
+            self.max_priority[0] = self.priorities[:len(self)].max()
+
+    def _resize(self, inputs, capacity):
+        """Remove the transitions saved with another capacity, returning
+        them oldest first"""
+        if self.path is None or not exists(join(self.path, 'rewards.npy')):
+            return None
+        saved = dict((name, np.load(join(self.path, name + '.npy'),
+                                    mmap_mode='r'))
+                     for name in ReplayBuffer.transitions + ['state'])
+        old = len(saved['rewards'])
+        # buffers of other inputs are refused as they are opened
+        if old == capacity or saved['inputs'].shape[1:] != (inputs,):
+            return None
+
+        ct, pos = saved['state']
+        order = (pos - ct + np.arange(ct)) % old
+        kept = [np.array(saved[name][order])
+                for name in ReplayBuffer.transitions]
+        del saved
+        for name in ReplayBuffer.transitions + ['state']:
+            os.remove(join(self.path, name + '.npy'))
+        log.info("Resized %s from %s to %s transitions", self.path, old,
+                 capacity)
+        return kept
+
+    def _array(self, name, dtype, shape):
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+
+        fn = join(self.path, name + '.npy')
+        if not exists(fn):
+            return np.lib.format.open_memmap(fn, mode='w+', dtype=dtype,
+                                             shape=shape)
+        array = np.load(fn, mmap_mode='r+')
+        if array.dtype != dtype or array.shape != shape:
+            raise ValueError("%s holds %s %s, expected %s %s" %
+                             (fn, array.shape, array.dtype, shape,
+                              np.dtype(dtype)))
+        return array
+
+    def __len__(self):
+        return int(self.state[0])
+
+    @property
+    def capacity(self):
+        return len(self.rewards)
+
+    def add(self, inputs, actions, rewards, next_inputs=None, done=None,
+            priorities=None):
+        """Add a batch of transitions, replacing the oldest when full
+
+        Transitions without next inputs are terminal. New transitions are
+        given the highest priority yet seen unless priorities are specified.
+        Of a batch larger than the buffer, only the last transitions are kept.
+        """
+        n = len(inputs)
+        if n > self.capacity:
+            keep = slice(n - self.capacity, n)
+            inputs, actions, rewards = [np.asarray(x)[keep] for x in
+                                        (inputs, actions, rewards)]
+            if next_inputs is not None:
+                next_inputs = np.asarray(next_inputs)[keep]
+            if done is not None and np.ndim(done):
+                done = np.asarray(done)[keep]
+            if priorities is not None and np.ndim(priorities):
+                priorities = np.asarray(priorities)[keep]
+            n = self.capacity
+        ct, pos = self.state
+        if priorities is None:
+            priorities = self.max_priority[0] if ct else 1.0
+
+        i = (pos + np.arange(n)) % self.capacity
+        self.inputs[i] = inputs
+        self.actions[i] = actions
+        self.rewards[i] = rewards
+        if next_inputs is None:
+            self.next_inputs[i] = 0.0
+            self.done[i] = True
+        else:
+            self.next_inputs[i] = next_inputs
+            self.done[i] = False if done is None else done
+        self._set_priorities(i, priorities)
+        self.state[:] = min(ct + n, self.capacity), (pos + n) % self.capacity
+
+    def batch(self, i):
+        """The inputs, actions, rewards, next inputs and done flags of the
+        transitions at indices i"""
+        return (self.inputs[i], self.actions[i], self.rewards[i],
+                self.next_inputs[i], self.done[i])
+
+    def sample(self, n, rnd=np.random):
+        """Indices of n transitions sampled uniformly with replacement"""
+        if not len(self):
+            raise ValueError("cannot sample an empty buffer")
+        return rnd.randint(len(self), size=n)
+
+    def sample_prioritized(self, n, alpha=0.6, beta=0.4, rnd=np.random):
+        """Indices of n transitions sampled in proportion to priority**alpha,
+        along with their importance sampling weights, normalized to at most 1
+        """
+        if not len(self):
+            raise ValueError("cannot sample an empty buffer")
+        p = self.priorities[:len(self)] ** alpha
+        cumulative = np.cumsum(p)
+        i = np.searchsorted(cumulative, rnd.rand(n) * cumulative[-1],
+                            side='right')
+        i = np.minimum(i, len(self) - 1)
+        weights = (len(self) * p[i] / cumulative[-1]) ** -beta
+        return i, weights / weights.max()
+
+    def update_priorities(self, i, priorities):
+        self._set_priorities(i, priorities)
+
+    def _set_priorities(self, i, priorities):
+        self.priorities[i] = priorities
+        if np.size(priorities):
+            self.max_priority[0] = max(self.max_priority[0],
+                                       np.max(priorities))
+
+    def flush(self):
+        if self.path is not None:
+            for name in self.fields:
+                getattr(self, name).flush()
@@ -0,0 +1,298 @@
+import numpy as np
+
+from .data import Simulator, SiteArrays, normalize
+
+
+# drilling proceeds 10m at a time to a maximum of 100m, matching the
+# assumptions made by UtilityEstimator
+DRILL_INCREMENT = 10
+MAX_DEPTH = 10
+
+WEEKS = 52
+
+# size of the fields played on, unless drawn from a corpus
+WIDTH, HEIGHT = 80, 24
+
+# fraction of a reservoir's remaining reserves pumped by each well weekly
+OUTPUT_RATE = 0.05
+
+# actions, as indices of the corresponding component outputs
+DRILL, PASS = 0, 1
+STOP = 1
+SELL, KEEP = 0, 1
+
+
+def site_returns(sites, seqs, rewards):
+    """Sum of each reward and of every later reward for the same site"""
+    # group by site with the latest decisions first
+    order = np.lexsort((-seqs, sites))
+    ordered = sites[order]
+    cumulative = np.cumsum(rewards[order])
+    starts = np.r_[True, ordered[1:] != ordered[:-1]]
+    before = (cumulative - rewards[order])[starts]
+    returns = np.empty(len(rewards))
+    returns[order] = cumulative - before[np.cumsum(starts) - 1]
+    return returns
+
+
+class Transitions:
+    """Preallocated record of one component's decisions during a game
+
+    Each decision keeps its inputs, the chosen action and its immediate
+    reward, along with the site it concerns and its order in the game. Once
+    the game is over, the return of each decision is the sum of the rewards
+    for its site from then on.
+    """
+
+    def __init__(self, inputs, capacity):
+        self.inputs = np.zeros((capacity, inputs))
+        self.actions = np.zeros(capacity, dtype=int)
+        self.rewards = np.zeros(capacity)
+        self.returns = np.zeros(capacity)
+        self.sites = np.zeros(capacity, dtype=int)
+        self.seqs = np.zeros(capacity, dtype=int)
+        self.ct = 0
+
+    def add(self, inputs, actions, rewards, sites, seq):
+        i, j = self.ct, self.ct + len(inputs)
+        self.inputs[i:j] = inputs
+        self.actions[i:j] = actions
+        self.rewards[i:j] = rewards
+        self.sites[i:j] = sites
+        self.seqs[i:j] = seq
+        self.ct = j
+
+
+class Games:
+    """K headless single player games of wildcatting played in lockstep
+
+    Each week the agent surveys a site in every game, decides from each
+    surveyor's report whether to drill, decides 10m at a time whether to keep
+    drilling, and decides for each producing well whether to sell it. State
+    is held as (K, ...) arrays, so that each decision is made for all games
+    with a single NN evaluation. Arrays are allocated once so that the games
+    may be reset and played repeatedly. With probability epsilon, each
+    decision is replaced by a random one. The games share one oil price.
+    Fields are generated by a Simulator, or drawn from a FieldCorpus if one
+    is given.
+    """
+
+    def __init__(self, agent, theme, count=1, width=WIDTH, height=HEIGHT,
+                 weeks=WEEKS, epsilon=0.0, seed=None, fast=False,
+                 corpus=None, models=None):
+        if corpus is not None:
+            width, height = corpus.width, corpus.height
+        self.agent = agent
+        self.theme = theme
+        self.count = count
+        self.width = width
+        self.height = height
+        self.weeks = weeks
+        self.epsilon = epsilon
+        self.rnd = np.random.RandomState(seed)
+        self.sim = Simulator(theme, fast, models)
+        self.corpus = corpus
+        self.prices = theme.getOilPrices()
+        self.income_scale = (OUTPUT_RATE * theme.getMeanSiteReserves() *
+                             self.prices._maxPrice)
+        # returns are squashed into utilities as by UtilityEstimator
+        self.utility_scale = (5 * theme.getMeanSiteReserves() *
+                              self.prices._maxPrice)
+
+        self.games = np.arange(count)
+        self.drilled = np.zeros((count, width * height), dtype=bool)
+        # at most one well is struck a week
+        self.wells = np.zeros((count, weeks), dtype=int)
+        self.ages = np.zeros((count, weeks), dtype=int)
+        self.producing = np.zeros((count, weeks), dtype=bool)
+        self.well_ct = np.zeros(count, dtype=int)
+        self.strikes = np.zeros(count, dtype=int)
+        self.strike_depth = np.zeros(count, dtype=int)
+        self.cash = np.zeros(count)
+
+        self.transitions = {
+            'surveying': Transitions(agent.surveying.inputs, count * weeks),
+            'report': Transitions(agent.report.inputs, count * weeks),
+            'drilling': Transitions(agent.drilling.inputs,
+                                    count * weeks * MAX_DEPTH),
+            'sales': Transitions(agent.sales.inputs, count * weeks * weeks)}
+
+    def reset(self, fields=None):
+        if fields is None and self.corpus is not None:
+            fields = self.corpus.sample(self.count, self.rnd)
+        elif fields is None:
+            fields = self.sim.fields(self.count, self.width, self.height)
+        self.fields = [SiteArrays.of(f) for f in fields]
+
+        # flattened site attributes, normalized where they are NN inputs
+        theme = self.theme
+        self.prob = normalize(self._stack('prob'), 0.0, 100.0)
+        self.cost = self._stack('cost')
+        self.cost_n = normalize(self.cost, theme.getMinDrillCost(),
+                                theme.getMaxDrillCost())
+        self.tax = self._stack('tax')
+        self.tax_n = normalize(self.tax, theme.getMinTax(),
+                               theme.getMaxTax())
+        self.depth = self._stack('depth')
+        self.oil = self._stack('oil') > 0
+
+        # wells on the same reservoir draw down the same reserves, numbered
+        # across every game
+        self.reservoir = self._stack('reservoir').astype(int)
+        counts = self.reservoir.max(axis=1) + 1
+        wet = self.reservoir >= 0
+        self.reservoir[wet] += np.repeat(np.cumsum(counts) - counts,
+                                         wet.sum(axis=1))
+        self.remaining = np.zeros(counts.sum())
+        self.remaining[self.reservoir[wet]] = self._stack('reserves')[wet]
+
+        self.drilled[:] = False
+        self.producing[:] = False
+        self.ages[:] = 0
+        self.well_ct[:] = 0
+        self.strikes[:] = 0
+        self.strike_depth[:] = 0
+        self.cash[:] = 0.0
+        self.week = 0
+        self.seq = 0
+        for t in self.transitions.values():
+            t.ct = 0
+
+    def _stack(self, attr):
+        return np.array([getattr(f, attr).ravel() for f in self.fields])
+
+    def play(self, fields=None):
+        """Play every game through, returning the agent's profit in each"""
+        self.reset(fields)
+        for week in xrange(self.weeks):
+            self.week = week
+            sites = self.survey()
+            self.report(sites)
+            self.produce()
+            self.prices.next()
+        self.finish()
+        return self.cash.copy()
+
+    def _act(self, utilities):
+        return self._explore(np.argmax(utilities, axis=1), utilities.shape[1])
+
+    def _explore(self, actions, choices):
+        if self.epsilon:
+            explore = self.rnd.rand(len(actions)) < self.epsilon
+            actions[explore] = self.rnd.randint(choices, size=explore.sum())
+        return actions
+
+    def _record(self, name, inputs, actions, rewards, games, sites):
+        # sites are keyed across games so that returns stay within a game
+        keys = games * self.drilled.shape[1] + sites
+        self.transitions[name].add(inputs, actions, rewards, keys, self.seq)
+        self.seq += 1
+
+    def survey(self):
+        regions, choices = self.agent.surveying.descend(self.fields)
+        choices = self._explore(choices, regions[0].wh[0] * regions[0].wh[1])
+        coords = np.array([r.pos + r.coords(i)
+                           for r, i in zip(regions, choices)])
+        sites = coords[:, 1] * self.width + coords[:, 0]
+        inputs = np.array([r.inputs(['prob', 'cost']) for r in regions])
+        self._record('surveying', inputs, choices, 0.0, self.games, sites)
+        return sites
+
+    def report(self, sites):
+        games = np.flatnonzero(~self.drilled[self.games, sites])
+        sites = sites[games]
+        if not len(games):
+            return
+
+        price = normalize(self.prices._price, self.prices._minPrice,
+                          self.prices._maxPrice)
+        inputs = np.column_stack([self.prob[games, sites],
+                                  self.cost_n[games, sites],
+                                  self.tax_n[games, sites],
+                                  np.repeat(price, len(games))])
+        actions = self._act(self.agent.report.sim(inputs))
+        self._record('report', inputs, actions, 0.0, games, sites)
+        drill = actions == DRILL
+        self.drill(games[drill], sites[drill])
+
+    def drill(self, games, sites):
+        self.drilled[games, sites] = True
+        cost = self.cost[games, sites] * DRILL_INCREMENT
+        strikes = np.maximum(self.strikes[games], 1)
+        expected = np.where(self.strikes[games],
+                            self.strike_depth[games] / strikes.astype(float),
+                            MAX_DEPTH / 2.0)
+
+        inputs = np.empty((len(games), 3))
+        inputs[:, 0] = self.cost_n[games, sites]
+        inputs[:, 2] = normalize(expected, 0, MAX_DEPTH)
+        for depth in xrange(MAX_DEPTH):
+            if not len(games):
+                return
+
+            inputs[:, 1] = normalize(depth, 0, MAX_DEPTH)
+            actions = self._act(self.agent.drilling.sim(inputs))
+            drilling = actions != STOP
+            rewards = np.where(drilling, -cost, 0.0)
+            self._record('drilling', inputs, actions, rewards, games, sites)
+            # a game drills at most one site a week
+            self.cash[games] += rewards
+
+            struck = (drilling & self.oil[games, sites] &
+                      (depth + 1 >= self.depth[games, sites]))
+            self.strike(games[struck], sites[struck], depth + 1)
+            drilling &= ~struck
+            games, sites = games[drilling], sites[drilling]
+            cost, inputs = cost[drilling], inputs[drilling]
+
+    def strike(self, games, sites, depth):
+        wells = self.well_ct[games]
+        self.wells[games, wells] = sites
+        self.producing[games, wells] = True
+        self.well_ct[games] += 1
+        self.strikes[games] += 1
+        self.strike_depth[games] += depth
+
+    def produce(self):
+        games, wells = np.nonzero(self.producing)
+        if not len(games):
+            return
+
+        sites = self.wells[games, wells]
+        reservoirs = self.reservoir[games, sites]
+        bbl = OUTPUT_RATE * self.remaining[reservoirs]
+        income = bbl * self.prices._price
+        tax = self.tax[games, sites]
+
+        inputs = np.column_stack([np.tanh(income / self.income_scale),
+                                  self.tax_n[games, sites],
+                                  normalize(self.ages[games, wells], 0,
+                                            self.weeks)])
+        actions = self._act(self.agent.sales.sim(inputs))
+        keep = actions == KEEP
+        rewards = np.where(keep, income - tax, 0.0)
+        self._record('sales', inputs, actions, rewards, games, sites)
+
+        self.producing[games[~keep], wells[~keep]] = False
+        np.subtract.at(self.remaining, reservoirs[keep], bbl[keep])
+        np.maximum(self.remaining, 0.0, out=self.remaining)
+        self.ages[games, wells] += 1
+        np.add.at(self.cash, games, rewards)
+
+    def experience(self):
+        """Copies of the inputs, actions and utilities of the decisions made
+        by each component in the last play"""
+        return dict([(name, (t.inputs[:t.ct].copy(), t.actions[:t.ct].copy(),
+                             np.tanh(t.returns[:t.ct] / self.utility_scale)))
+                     for name, t in self.transitions.items()])
+
+    def finish(self):
+        transitions = self.transitions.values()
+        sites, seqs, rewards = [np.concatenate([getattr(t, a)[:t.ct]
+                                                for t in transitions])
+                                for a in ['sites', 'seqs', 'rewards']]
+        returns = site_returns(sites, seqs, rewards)
+        i = 0
+        for t in transitions:
+            t.returns[:t.ct] = returns[i:i + t.ct]
+            i += t.ct
@@ -0,0 +1,78 @@
+import json
+import logging
+import timeit
+
+
+# A registry of the time spent in, and the number of calls to, named stages
+# of the hot paths. It is disabled by default, when timed() returns a shared
+# no-op context manager and count() returns at once, so that instrumented
+# code costs next to nothing unless the registry has been enabled.
+enabled = False
+_stages = {}
+
+log = logging.getLogger("wcai")
+
+
+class _Timer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *exc):
+        stage = _stages.setdefault(self.name, [0, 0.0])
+        stage[0] += 1
+        stage[1] += timeit.default_timer() - self.start
+
+
+class _Untimed:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_untimed = _Untimed()
+
+
+def timed(name):
+    """A context manager adding the time spent within it to a stage"""
+    if not enabled:
+        return _untimed
+    return _Timer(name)
+
+
+def count(name, n=1):
+    """Add n to a counter, with no time attached"""
+    if enabled:
+        _stages.setdefault(name, [0, 0.0])[0] += n
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    _stages.clear()
+
+
+def stats():
+    """{stage: {'count': n, 'seconds': s}} of everything recorded"""
+    return dict((name, {'count': ct, 'seconds': secs})
+                for name, (ct, secs) in _stages.items())
+
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(stats(), f, indent=2, sort_keys=True)
+
+
+def log_stats():
+    for name, (ct, secs) in sorted(_stages.items()):
+        if secs:
+            log.debug("%s: %s calls, %.3fs", name, ct, secs)
+        else:
+            log.debug("%s: %s", name, ct)
@@ -1,11 +1,22 @@
+import argparse
+import bz2
 import logging
+import multiprocessing
+import random
 import sys
+import zlib
+
+from StringIO import StringIO
+
+import numpy as np
 
 from wildcatting.theme import DefaultTheme
 
+from wcai import timing
+from wcai.corpus import FieldCorpus
 from wcai.data import (Simulator, Region, OilProbability, DrillCost, Taxes,
                        OilPresence, OilReserves, ReservoirSize, OilValue,
-                       UtilityEstimator, normalize)
+                       UtilityEstimator, normalize, data_header)
 
 
 log = logging.getLogger("wildcatting-ai")
@@ -46,6 +57,19 @@ class OilPriceCommand:
             OilPriceCommand.write(args, sys.stdout)
 
 
+def _pair(sep):
+    def parse(text):
+        try:
+            a, b = [int(n) for n in text.split(sep)]
+        except ValueError:
+            raise argparse.ArgumentTypeError("expected two integers "
+                                             "separated by %r" % sep)
+        if a < 1 or b < 1:
+            raise argparse.ArgumentTypeError("expected positive integers")
+        return a, b
+    return parse
+
+
 class FieldCommand:
 
     val_map = {'prob': OilProbability, 'cost': DrillCost, 'tax': Taxes,
@@ -76,14 +100,45 @@ class FieldCommand:
                                help="scale down by the specified factor")
         subparser.add_argument("--partition", type=int,
                                help="output partitions of a larger field")
+        subparser.add_argument("--window", type=_pair('x'), metavar="WxH",
+                               help="output sliding windows of a larger "
+                               "field")
+        subparser.add_argument("--stride", type=_pair(','), metavar="SX,SY",
+                               help="window step, by default half a window")
+        subparser.add_argument("--boundary", choices=Region.boundaries,
+                               default='drop',
+                               help="treatment of windows overhanging the "
+                               "field's edges")
+        subparser.add_argument("--crops", type=int, default=0,
+                               help="output n windows at random positions "
+                               "instead")
         subparser.add_argument("--file", type=str, default=None,
                                help="write to specified file")
+        subparser.add_argument("--seed", type=int, default=None,
+                               help="seed for reproducible fields")
+        subparser.add_argument("--workers", type=int, default=1,
+                               help="generate fields in n processes")
+        subparser.add_argument("--format", choices=['text', 'binary'],
+                               default='text',
+                               help="binary writes float32 training data")
+        subparser.add_argument("--compress",
+                               choices=OutputStream.compressors.keys(),
+                               help="compress text output")
+        subparser.add_argument("--buffer", type=int, default=1 << 20,
+                               help="output buffer size in bytes")
+        subparser.add_argument("--fast", action="store_true", default=False,
+                               help="generate fields with the fast simulator")
+        subparser.add_argument("--corpus", type=str, default=None,
+                               help="read fields from a field corpus")
 
         subparser.set_defaults(run=cls.run)
 
     @staticmethod
-    def run(args):
+    def writer(args, models=None):
         theme = DefaultTheme()
+        if args.corpus:
+            corpus = FieldCorpus(args.corpus)
+            args.width, args.height = corpus.width, corpus.height
 
         ins = []
         for i in args.inputs:
@@ -96,62 +151,220 @@ class FieldCommand:
                                                 args.width * args.height,
                                                 args.normalize))
 
-        fw = FieldWriter(args, theme, ins, outs)
+        return FieldWriter(args, theme, ins, outs, models)
+
+    @staticmethod
+    def run(args):
+        if args.compress and args.format == 'binary':
+            log.error("binary data is memory mapped and cannot be compressed")
+            sys.exit(1)
+        if args.window and args.partition:
+            log.error("fields are either partitioned or windowed")
+            sys.exit(1)
+        if args.stride and args.crops:
+            log.error("crops are taken at random positions, without a stride")
+            sys.exit(1)
+
+        # a corpus sets the field size
+        fw = FieldCommand.writer(args)
+        w, h = args.window or (0, 0)
+        if args.boundary == 'drop' and (w > args.width or h > args.height):
+            log.error("%sx%s windows overhang %sx%s fields, which drops them; "
+                      "use --boundary edge or wrap to keep them" %
+                      (w, h, args.width, args.height))
+            sys.exit(1)
         if args.file:
-            with open(args.file, 'w') as f:
+            with open(args.file, 'wb') as f:
                 fw.write(f)
         else:
             fw.write(sys.stdout)
 
 
+class CorpusCommand:
+    @classmethod
+    def add_subparser(cls, parser):
+        subparser = parser.add_parser("corpus",
+                                      help="Generate a corpus of oil fields")
+        subparser.add_argument("path", help="corpus directory")
+        subparser.add_argument("--width", default=80, type=int,
+                               help="oil field width")
+        subparser.add_argument("--height", default=24, type=int,
+                               help="oil field height")
+        subparser.add_argument("--num", default=1000, type=int,
+                               help="number of fields to generate")
+        subparser.add_argument("--seed", type=int, default=None,
+                               help="seed for reproducible fields")
+        subparser.add_argument("--fast", action="store_true", default=False,
+                               help="generate fields with the fast simulator")
+
+        subparser.set_defaults(run=cls.run)
+
+    @staticmethod
+    def run(args):
+        sim = Simulator(DefaultTheme(), args.fast)
+        FieldCorpus.create(args.path, sim, args.num, args.width, args.height,
+                           args.seed)
+
+
+class OutputStream:
+    """Buffers writes to an output file, optionally compressing them"""
+
+    compressors = {'gzip': lambda: zlib.compressobj(6, zlib.DEFLATED,
+                                                    16 + zlib.MAX_WBITS),
+                   'bz2': bz2.BZ2Compressor}
+
+    def __init__(self, out, size, compress=None):
+        self.out = out
+        self.size = size
+        self.compressor = None
+        if compress:
+            self.compressor = OutputStream.compressors[compress]()
+        self.chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        data = ''.join(self.chunks)
+        self.chunks = []
+        self.buffered = 0
+        with timing.timed('io.write'):
+            if self.compressor:
+                data = self.compressor.compress(data)
+            self.out.write(data)
+        timing.count('io.bytes', len(data))
+
+    def close(self):
+        self.flush()
+        if self.compressor:
+            self.out.write(self.compressor.flush())
+        self.out.flush()
+
+
 class FieldWriter:
-    def __init__(self, args, theme, ins, outs):
+    def __init__(self, args, theme, ins, outs, models=None):
         self.args = args
         self.theme = theme
         self.ins = ins
         self.outs = outs
+        self.sim = Simulator(theme, args.fast, models)
+        self.corpus = args.corpus and FieldCorpus(args.corpus)
 
     def write_headers(self, site_ct, out):
-        # inputs
-        for site in xrange(site_ct):
-            for i in self.ins:
-                out.write("%s_%s%s" % (i.key.upper(), site,
-                                       self.args.delim))
-        # outputs
-        for site in xrange(site_ct):
-            for o in self.outs:
-                out.write("%s_%s%s" % (o.key.upper(), site,
-                                       self.args.delim))
-
-    def write_values(self, region, val_funcs, out):
-        for site in region.sites:
-            for vf in val_funcs:
-                out.write("%s%s" % (site[vf.key], self.args.delim))
+        headers = []
+        for val_funcs in [self.ins, self.outs]:
+            headers.extend(["%s_%s" % (vf.key.upper(), site)
+                            for site in xrange(site_ct)
+                            for vf in val_funcs])
+        out.write(self.args.delim.join(headers) + '\n')
 
     def write(self, out):
-        if not self.args.no_headers:
-            site_ct = (self.args.width * self.args.height /
-                       self.args.reduce ** 2)
-            if self.args.partition:
-                site_ct /= self.args.partition ** 2
+        out = OutputStream(out, self.args.buffer, self.args.compress)
+
+        w, h = self.region_size()
+        site_ct = w * h
+        if self.args.format == 'binary':
+            out.write(data_header(site_ct * len(self.ins),
+                                  site_ct * len(self.outs)))
+        elif not self.args.no_headers:
             self.write_headers(site_ct, out)
 
-        sim = Simulator(DefaultTheme())
-        for i in xrange(self.args.num):
-            field = sim.field(self.args.width, self.args.height)
-            val_funcs = self.ins + self.outs
-            region = Region.map(field, val_funcs)
-
-            if self.args.partition:
-                regions = region.partition(field, self.args.partition,
-                                           val_funcs)
-            else:
-                regions = [region]
-
-            if self.args.reduce != 1:
-                regions = [Region.reduce(r, self.args.reduce) for r in regions]
-
-            for region in regions:
-                self.write_values(region, self.ins, out)
-                self.write_values(region, self.outs, out)
-                out.write('\n')
+        if self.args.workers > 1:
+            # workers format whole fields, which are written in field order,
+            # and share a model fitted once here
+            if self.args.fast and not self.corpus:
+                self.sim.model(self.args.width, self.args.height)
+            pool = multiprocessing.Pool(self.args.workers, _init_worker,
+                                        (self.args, self.sim.models))
+            try:
+                for rows in pool.imap(_format_field, xrange(self.args.num),
+                                      chunksize=16):
+                    out.write(rows)
+            finally:
+                pool.terminate()
+        else:
+            for i in xrange(self.args.num):
+                out.write(self.format(self.rows(i)))
+        out.close()
+
+    def region_size(self):
+        """The width and height of each region written, once reduced"""
+        w, h = self.args.width, self.args.height
+        if self.args.partition:
+            w, h = w / self.args.partition, h / self.args.partition
+        elif self.args.window:
+            w, h = self.args.window
+        # as Region.reduce scales each side
+        return w / self.args.reduce, h / self.args.reduce
+
+    def rows(self, i):
+        """Generate field i and return one row per region, inputs first"""
+        if self.corpus:
+            field = self.corpus.field(i % len(self.corpus))
+        else:
+            seed = None
+            if self.args.seed is not None:
+                # each field has its own seed so that output does not depend
+                # on which worker generated it
+                seed = hash((self.args.seed, i))
+            field = self.sim.field(self.args.width, self.args.height, seed)
+        val_funcs = self.ins + self.outs
+
+        if self.args.window:
+            windows = self.windows(Region.map(field, val_funcs))
+            if self.args.reduce == 1:
+                # one copy of the strided windows' channels into the rows
+                k = len(self.ins)
+                return np.concatenate(
+                    [windows[..., :k].reshape(len(windows), -1),
+                     windows[..., k:].reshape(len(windows), -1)], axis=1)
+            keys = [vf.key for vf in val_funcs]
+            regions = [Region(field, keys, w) for w in windows]
+        elif self.args.partition:
+            regions = Region.partition(field, self.args.partition,
+                                       val_funcs)
+        else:
+            regions = [Region.map(field, val_funcs)]
+
+        if self.args.reduce != 1:
+            regions = [Region.reduce(r, self.args.reduce) for r in regions]
+
+        ins = [vf.key for vf in self.ins]
+        outs = [vf.key for vf in self.outs]
+        return np.array([np.concatenate([r.inputs(ins), r.inputs(outs)])
+                         for r in regions])
+
+    def windows(self, region):
+        """(n, height, width, channels) windows of a field's region"""
+        wh = self.args.window
+        if self.args.crops:
+            return region.crops(wh, self.args.crops, self.args.boundary)
+        stride = self.args.stride or (max(wh[0] / 2, 1), max(wh[1] / 2, 1))
+        windows = region.slide(wh, stride, self.args.boundary)
+        return windows.reshape((-1,) + windows.shape[2:])
+
+    def format(self, rows):
+        if self.args.format == 'binary':
+            return rows.astype('<f4').tostring()
+        out = StringIO()
+        np.savetxt(out, rows, fmt='%s', delimiter=self.args.delim)
+        return out.getvalue()
+
+
+_writer = None
+
+
+def _init_worker(args, models):
+    global _writer
+    # forked workers inherit the parent's random state
+    random.seed()
+    np.random.seed()
+    _writer = FieldCommand.writer(args, models)
+
+
+def _format_field(i):
+    return _writer.format(_writer.rows(i))
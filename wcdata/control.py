@@ -1,16 +1,24 @@
 #!/usr/bin/env python
 
 import argparse
+import cProfile
 import logging
 import sys
 
+from wcai import timing
+
 from . import commands
 
 parser = argparse.ArgumentParser(description="wildcatting-ai control")
 parser.add_argument("--debug", action="store_true", help=argparse.SUPPRESS)
+parser.add_argument("--profile", metavar="FILE",
+                    help="write cProfile stats to the specified file")
+parser.add_argument("--stats", metavar="FILE",
+                    help="write hot path timings to the specified JSON file")
 
 subparsers = parser.add_subparsers(title="Commands")
 commands.FieldCommand.add_subparser(subparsers)
+commands.CorpusCommand.add_subparser(subparsers)
 commands.OilPriceCommand.add_subparser(subparsers)
 
 
@@ -27,11 +35,21 @@ def main():
     else:
         logging.root.setLevel(logging.INFO)
 
+    # timings are logged at --debug
+    timing.enable(args.debug or args.stats is not None)
     try:
-        args.run(args)
+        if args.profile:
+            cProfile.runctx("args.run(args)", globals(), locals(),
+                            args.profile)
+        else:
+            args.run(args)
     except KeyboardInterrupt:
         print
         sys.exit(1)
+    finally:
+        if args.stats:
+            timing.dump(args.stats)
+        timing.log_stats()
 
 if __name__ == "__main__":
     main()